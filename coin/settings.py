@@ -64,6 +64,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'main.metrics.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -145,3 +146,87 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.0/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+# Write-behind mode for update_coins_and_energy: tap syncs are merged in memory
+# per player and flushed with one bulk_update every PLAYER_SYNC_FLUSH_INTERVAL
+# seconds or as soon as PLAYER_SYNC_MAX_PENDING players are waiting. The buffer
+# is per process: a flush is dropped when the balance changed since the sync
+# was buffered, so with several workers a player's syncs should be routed to
+# one of them (or the mode left off), otherwise their taps can be dropped.
+PLAYER_SYNC_WRITE_BEHIND = os.getenv("PLAYER_SYNC_WRITE_BEHIND", "0") == "1"
+PLAYER_SYNC_FLUSH_INTERVAL = float(os.getenv("PLAYER_SYNC_FLUSH_INTERVAL", "2"))
+PLAYER_SYNC_MAX_PENDING = int(os.getenv("PLAYER_SYNC_MAX_PENDING", "5000"))
+
+# Caches. Catalog versions (leagues, memes, ...) live in CATALOG_CACHE; point
+# REDIS_URL at a shared Redis (requires the redis package) so an admin edit
+# invalidates every worker immediately instead of after the catalog max age.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    }
+}
+if os.getenv("REDIS_URL"):
+    CACHES["shared"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("REDIS_URL"),
+    }
+CATALOG_CACHE = "shared" if "shared" in CACHES else "default"
+# Pre-serialized catalog responses (get_all_leagues, get_task, get_team,
+# get_teams). Local memory by default; "shared" lets workers reuse each
+# other's copies at the cost of a network round trip per request.
+CATALOG_RESPONSE_CACHE = os.getenv("CATALOG_RESPONSE_CACHE", "default")
+
+# Player rows served to read-only endpoints (main/player_cache.py). Each
+# process keeps up to PLAYER_CACHE_SIZE rows for PLAYER_CACHE_LOCAL_TTL
+# seconds, which bounds how stale another worker's copy can get; 0 turns the
+# local tier off. PLAYER_CACHE_SHARED names a cache alias shared by every
+# worker, kept for PLAYER_CACHE_TTL seconds; empty turns the shared tier off.
+PLAYER_CACHE_SIZE = int(os.getenv("PLAYER_CACHE_SIZE", "10000"))
+PLAYER_CACHE_LOCAL_TTL = float(os.getenv("PLAYER_CACHE_LOCAL_TTL", "2"))
+PLAYER_CACHE_SHARED = os.getenv("PLAYER_CACHE_SHARED", "shared" if "shared" in CACHES else "")
+PLAYER_CACHE_TTL = int(os.getenv("PLAYER_CACHE_TTL", "60"))
+
+# Team leaderboard snapshot served by get_top_teams (also the upper bound of
+# its limit parameter) and how long a snapshot is reused before it is rebuilt.
+# The snapshot lives in CATALOG_CACHE: with the local-memory default each
+# worker rebuilds its own copy once the TTL runs out, and the
+# refresh_team_leaderboard command only reaches workers through "shared".
+TEAM_LEADERBOARD_SIZE = 100
+TEAM_LEADERBOARD_TTL = int(os.getenv("TEAM_LEADERBOARD_TTL", "60"))
+
+# Outbound Telegram messages are queued in the database and delivered by the
+# send_outbound_messages command. TELEGRAM_API_URL can point at a local fake
+# Bot API server, TELEGRAM_TRANSPORT=main.telegram.MemoryTransport skips HTTP.
+# The bot token only comes from the environment; without it the HTTP
+# transport refuses to start and messages stay queued.
+TELEGRAM_API_TOKEN = os.getenv("TELEGRAM_API_TOKEN", "")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+TELEGRAM_TRANSPORT = os.getenv("TELEGRAM_TRANSPORT", "main.telegram.HttpTransport")
+TELEGRAM_RATE_LIMIT = float(os.getenv("TELEGRAM_RATE_LIMIT", "25"))
+
+# Database the load_test command seeds and replays against, on the same
+# server as DATABASES["default"]. Empty refuses to run under these settings;
+# point --settings at a load testing settings module instead.
+LOAD_TEST_DB_NAME = os.getenv("LOAD_TEST_DB_NAME", "")
+
+# Serve initialize_user, get_player_energy, get_user_boosts, get_user_upgrades
+# and friends_list with the async views in main/async_views.py. Only worth
+# enabling when running under an ASGI server (uvicorn coin.asgi:application).
+# Every in-flight async request holds its own database connection, so put a
+# pooler such as pgbouncer in front of Postgres or cap the server with
+# --limit-concurrency below max_connections.
+ASYNC_HOT_READS = os.getenv("ASYNC_HOT_READS", "0") == "1"
+
+# Per-view request metrics (main/metrics.py), served in the Prometheus text
+# format at /metrics/, off unless METRICS_ENABLED=1. Scrapes must send
+# "Authorization: Bearer <METRICS_TOKEN>"; without a token only loopback
+# clients (a scraper sidecar) are served. Requests slower than
+# SLOW_REQUEST_MS are logged with their slowest SQL statement, 0 turns that off.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "1000"))
+
+# Commission paid to referrers on the coins their referrals earn, by level of
+# the referred_by chain: 10% to the direct referrer, 5% to theirs, ... Paid in
+# batches by the pay_referral_commissions command; empty disables recording.
+REFERRAL_COMMISSION_RATES = (0.1, 0.05, 0.02)
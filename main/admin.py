@@ -1,61 +1,172 @@
+import json
+
 from django.contrib import admin
 from django import forms
-from .models import Player, Team, Task, PlayerTask, League, Meme, MemePlayer
-from django.contrib.admin.widgets import ForeignKeyRawIdWidget
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Value
+from django.db.models.functions import Collate, Upper
+from django.urls import reverse
+from django.utils.functional import cached_property
+from django.utils.html import format_html
+from .models import (
+    CoinLedger,
+    CoinLedgerArchive,
+    League,
+    Meme,
+    MemePlayer,
+    OutboundMessage,
+    Player,
+    PlayerTask,
+    ReferralEarning,
+    Task,
+    Team,
+)
+from .processors import TeamProcessor
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Takes the planner's row estimate as the total of a big changelist instead
+    of running COUNT(*) over millions of rows. Small results are still
+    counted exactly.
+    """
+    exact_below = 10000
+
+    @cached_property
+    def count(self):
+        estimate = self.estimate()
+        if estimate is not None and estimate >= self.exact_below:
+            return estimate
+        return super().count
+
+    def estimate(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor != "postgresql":
+            return None
+        sql, params = queryset.order_by().query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class ScalableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    # Filtered changelists would count the whole table again for "N total"
+    show_full_result_count = False
+
+
+class CappedInlineFormSet(forms.BaseInlineFormSet):
+    """Shows only the first max_rows related rows of the inline's ordering."""
+    max_rows = 20
+
+    def get_queryset(self):
+        if not hasattr(self, "_queryset"):
+            self._queryset = super().get_queryset()[:self.max_rows]
+        return self._queryset
+
+
+def changelist_link(model, text: str, **filters):
+    url = reverse(f"admin:{model._meta.app_label}_{model._meta.model_name}_changelist")
+    query = "&".join(f"{field}={value}" for field, value in filters.items())
+    return format_html('<a href="{}?{}">{}</a>', url, query, text)
+
 
 class PlayerTaskInlineForTask(admin.TabularInline):
     model = PlayerTask
+    formset = CappedInlineFormSet
     extra = 0
     fields = ['player', 'status', 'completion_date']
     readonly_fields = ['completion_date']
     autocomplete_fields = ['player']
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('player').order_by('-id')
+
 class PlayerTaskInlineForPlayer(admin.TabularInline):
     model = PlayerTask
     extra = 0
     fields = ['task', 'status', 'completion_date']
     readonly_fields = ['completion_date']
-
-class PlayerInlineForm(forms.ModelForm):
-    player = forms.ModelChoiceField(
-        queryset=Player.objects.all(),
-        widget=ForeignKeyRawIdWidget(Player._meta.get_field('team').remote_field, admin.site),
-        required=False
-    )
-
-    class Meta:
-        model = Player
-        fields = '__all__'
+    raw_id_fields = ['task']
 
 class PlayerInline(admin.TabularInline):
     model = Player
+    formset = CappedInlineFormSet
     extra = 0
-    
-
-class PlayerAdminForm(forms.ModelForm):
-    class Meta:
-        model = Player
-        fields = '__all__'
-
-    def __init__(self, *args, **kwargs):
-        super(PlayerAdminForm, self).__init__(*args, **kwargs)
-        instance = kwargs.get('instance')
-        if instance:
-            self.fields['friends'].queryset = Player.objects.exclude(telegram_id=instance.telegram_id)
-
-class PlayerAdmin(admin.ModelAdmin):
-    form = PlayerAdminForm
-    filter_horizontal = ('friends',)
+    max_num = 0
+    can_delete = False
+    show_change_link = True
+    fields = ['telegram_id', 'name', 'total_coins_earned']
+    readonly_fields = fields
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).order_by('-total_coins_earned')
+
+
+class PlayerAdmin(ScalableAdmin):
+    list_display = ['telegram_id', 'name', 'league', 'team', 'coins_balance', 'total_coins_earned']
+    list_select_related = ['league', 'team']
+    raw_id_fields = ['friends', 'referred_by']
+    autocomplete_fields = ['team']
     inlines = [PlayerTaskInlineForPlayer,]
-    search_fields = ['name', 'telegram_id']
-    
+    search_fields = ['^name']
 
+    def save_model(self, request, obj, form, change):
+        # Team totals follow the move the same way join_team/leave_team do;
+        # changeform_view runs this inside a transaction.
+        if change and "team" in form.changed_data:
+            locked = Player.objects.select_for_update().only("team", "total_coins_earned").get(pk=obj.pk)
+            TeamProcessor.move_player(locked, obj.team)
+        elif not change and obj.team_id is not None:
+            TeamProcessor.add_coins({obj.team_id: obj.total_coins_earned})
+        super().save_model(request, obj, form, change)
 
-class TaskAdmin(admin.ModelAdmin):
+    def get_search_results(self, request, queryset, search_term):
+        # Digits look up the telegram id by primary key, anything else is a
+        # name prefix; a substring search would scan the whole table.
+        search_term = search_term.strip()
+        if search_term.isdigit():
+            return queryset.filter(pk=int(search_term)), False
+        if not search_term:
+            return queryset, False
+        search_name = Upper("name")
+        if connections[queryset.db].vendor == "postgresql":
+            # Matches the index expression created by migration 0012
+            search_name = Collate(search_name, "C")
+        queryset = queryset.alias(search_name=search_name).filter(search_name__startswith=Upper(Value(search_term)))
+        return queryset, False
+
+
+
+class TaskAdmin(ScalableAdmin):
     inlines = [PlayerTaskInlineForTask,]
+    search_fields = ['name']
+    readonly_fields = ['assignments']
+
+    @admin.display(description='Assignments')
+    def assignments(self, obj):
+        return changelist_link(PlayerTask, 'All assignments of this task', task__id__exact=obj.pk)
 
-class TeamAdmin(admin.ModelAdmin):
+class TeamAdmin(ScalableAdmin):
     inlines = [PlayerInline,]
+    list_display = ['name', 'coins_count']
+    search_fields = ['name']
+    readonly_fields = ['members']
+
+    @admin.display(description='Members')
+    def members(self, obj):
+        return changelist_link(Player, 'All members of this team', team__id__exact=obj.pk)
+
+class PlayerTaskAdmin(ScalableAdmin):
+    list_display = ['id', 'player', 'task', 'status', 'completion_date']
+    list_select_related = ['player', 'task']
+    list_filter = ['status']
+    raw_id_fields = ['player', 'task']
 
 class LeagueAdmin(admin.ModelAdmin):
     pass
@@ -63,13 +174,37 @@ class LeagueAdmin(admin.ModelAdmin):
 class MemeAdmin(admin.ModelAdmin):
     pass
 
-class MemePlayerAdmin(admin.ModelAdmin):
-    pass
+class MemePlayerAdmin(ScalableAdmin):
+    list_display = ['id', 'player', 'meme', 'current_level', 'current_coins_per_hour']
+    list_select_related = ['player', 'meme']
+    raw_id_fields = ['player']
+
+class OutboundMessageAdmin(ScalableAdmin):
+    list_display = ['id', 'chat_id', 'status', 'attempts', 'next_attempt_at', 'sent_at']
+    list_filter = ['status']
+
+class ReferralEarningAdmin(ScalableAdmin):
+    list_display = ['id', 'player_id', 'coins', 'created_at']
+    raw_id_fields = ['player']
+
+class CoinLedgerAdmin(ScalableAdmin):
+    list_display = ['id', 'player_id', 'delta', 'reason', 'created_at']
+    list_filter = ['reason']
+    raw_id_fields = ['player']
+
+class CoinLedgerArchiveAdmin(ScalableAdmin):
+    list_display = ['id', 'player_id', 'delta', 'reason', 'created_at', 'applied_at']
+    list_filter = ['reason']
+    raw_id_fields = ['player']
 
 admin.site.register(Player, PlayerAdmin)
 admin.site.register(Team, TeamAdmin)
 admin.site.register(Task, TaskAdmin)
-admin.site.register(PlayerTask)
+admin.site.register(PlayerTask, PlayerTaskAdmin)
 admin.site.register(League, LeagueAdmin)
 admin.site.register(Meme, MemeAdmin)
-admin.site.register(MemePlayer, MemePlayerAdmin)
\ No newline at end of file
+admin.site.register(MemePlayer, MemePlayerAdmin)
+admin.site.register(OutboundMessage, OutboundMessageAdmin)
+admin.site.register(ReferralEarning, ReferralEarningAdmin)
+admin.site.register(CoinLedger, CoinLedgerAdmin)
+admin.site.register(CoinLedgerArchive, CoinLedgerArchiveAdmin)
@@ -0,0 +1,82 @@
+"""
+Async versions of the hottest read endpoints, for deployments served by an
+ASGI server (see ASYNC_HOT_READS in settings). They return exactly what the
+sync views in views.py return; the sync views stay as the WSGI fallback.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, HttpResponse
+
+from .models import Player
+from .player_cache import player_state_cache
+from .processors import FriendsProcessor, LedgerProcessor, PlayerProcessor
+from .views import (
+    flush_pending_sync,
+    friends_page_params,
+    persist_player_session,
+    player_boosts_data,
+    player_state_data,
+    player_upgrades_data,
+    start_player_session,
+)
+
+
+async def aflush_pending_sync(telegram_id):
+    if settings.PLAYER_SYNC_WRITE_BEHIND:
+        await sync_to_async(flush_pending_sync)(telegram_id)
+
+
+async def initialize_user(request):
+    telegram_id = request.GET.get("user_id")
+    await aflush_pending_sync(telegram_id)
+
+    try:
+        player = await (
+            Player.objects.select_related("league", "team")
+            .annotate(pending_coins=LedgerProcessor.pending_coins())
+            .aget(telegram_id=telegram_id)
+        )
+    except:
+        return HttpResponse("Invalid telegram ID", status=400)
+
+    # The session reads the catalogs (cache and ORM), so it runs in the sync thread
+    passive_income, changed = await sync_to_async(start_player_session, thread_sensitive=True)(player)
+    if changed:
+        player, passive_income = await sync_to_async(persist_player_session)(telegram_id)
+
+    return JsonResponse(player_state_data(player, passive_income))
+
+
+async def get_player_energy(request):
+    telegram_id = request.GET.get("user_id")
+    await aflush_pending_sync(telegram_id)
+    player = await player_state_cache.aget(telegram_id)
+
+    res = {
+        "energy_count": PlayerProcessor.current_energy(player)
+    }
+
+    return JsonResponse(res)
+
+
+async def get_user_boosts(request):
+    user_id = request.GET.get("user_id")
+    player = await player_state_cache.aget(user_id)
+    return JsonResponse(player_boosts_data(player))
+
+
+async def get_user_upgrades(request):
+    user_id = request.GET.get("user_id")
+    player = await player_state_cache.aget(user_id)
+    return JsonResponse(player_upgrades_data(player))
+
+
+async def friends_list(request):
+    user_id = request.GET.get("user_id")
+    try:
+        limit, cursor = friends_page_params(request)
+    except ValueError:
+        return JsonResponse({"error": "Invalid limit or cursor"}, status=400)
+    player = await player_state_cache.aget(user_id)
+    friends, next_cursor = await sync_to_async(FriendsProcessor.get_page)(player.pk, limit, cursor)
+    return JsonResponse({"friends": friends, "next_cursor": next_cursor})
@@ -0,0 +1,315 @@
+import asyncio
+import math
+import random
+import time
+from urllib.parse import urlsplit
+
+import requests
+from django.db import connection, transaction
+from django.test import Client
+
+from .models import League, Meme, OutboundMessage, Player, PlayerTask, Task, Team
+from .processors import FriendsProcessor, day_key
+
+
+def percentile(values, q: float) -> float:
+    """Nearest-rank percentile of values, q between 0 and 100."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = math.ceil(q / 100 * len(ordered))
+    return ordered[max(0, min(len(ordered), rank) - 1)]
+
+
+def summarize(latencies, elapsed: float) -> dict:
+    return {
+        "requests": len(latencies),
+        "throughput": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(max(latencies) * 1000, 2) if latencies else 0.0,
+    }
+
+
+class AsyncHttpClient:
+    """
+    Minimal HTTP/1.1 client on asyncio streams, one connection per request.
+    Enough to hold thousands of simultaneous requests open without threads or
+    extra dependencies.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 30):
+        parts = urlsplit(base_url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+
+    async def request(self, method: str, path: str, body: bytes = b"", headers=None):
+        """Returns (status, response body, seconds)."""
+        start = time.perf_counter()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout)
+        try:
+            lines = [
+                f"{method} {self.prefix}{path} HTTP/1.1",
+                f"Host: {self.host}",
+                "Connection: close",
+                f"Content-Length: {len(body)}",
+            ]
+            lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+            writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+            await writer.drain()
+            data = await asyncio.wait_for(reader.read(), self.timeout)
+        finally:
+            writer.close()
+        head, _, content = data.partition(b"\r\n\r\n")
+        status = int(head.split(b" ", 2)[1]) if head else 0
+        return status, content, time.perf_counter() - start
+
+
+SEED_PREFIX = "loadtest"
+
+
+class QueryCounter:
+    """
+    connection.execute_wrapper callable counting statements and the rows
+    written by INSERT/UPDATE/DELETE statements.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.rows_written = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        self.queries += 1
+        if sql.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            self.rows_written += max(context["cursor"].rowcount, 0)
+        return result
+
+
+def seed_population(first_id: int, players: int, teams: int, memes: int, tasks: int,
+                    friends: int, coins: int, batch_size: int = 5000) -> dict:
+    """
+    Bulk-insert a synthetic population: players with telegram ids starting at
+    first_id, plus teams, memes and tasks named with SEED_PREFIX, random
+    friendships and an available PlayerTask for every player/task pair.
+    Returns the population as load_population does.
+    """
+    now = int(time.time())
+    with transaction.atomic():
+        if not League.objects.exists():
+            League.objects.bulk_create(
+                League(name=f"{SEED_PREFIX}-{level}", level=level, coin_limit=0 if level == 1 else 10 ** (level + 3))
+                for level in range(1, 8)
+            )
+        first_league = League.objects.order_by("coin_limit", "level").first()
+        team_ids = [
+            team.id for team in Team.objects.bulk_create(
+                Team(name=f"{SEED_PREFIX} team {i}") for i in range(teams)
+            )
+        ]
+        meme_ids = [
+            meme.id for meme in Meme.objects.bulk_create(
+                Meme(name=f"{SEED_PREFIX} meme {i}", coins_per_hour=100 * (i + 1),
+                     upgrade_price=1000 * (i + 1), logo="")
+                for i in range(memes)
+            )
+        ]
+        task_ids = [
+            task.id for task in Task.objects.bulk_create(
+                Task(name=f"{SEED_PREFIX} task {i}", description="", link="") for i in range(tasks)
+            )
+        ]
+
+    player_ids = list(range(first_id, first_id + players))
+    Friendship = Player.friends.through
+    for start in range(0, players, batch_size):
+        batch = player_ids[start:start + batch_size]
+        with transaction.atomic():
+            Player.objects.bulk_create(
+                Player(
+                    telegram_id=telegram_id,
+                    name=f"{SEED_PREFIX} {telegram_id}",
+                    league=first_league,
+                    team_id=random.choice(team_ids) if team_ids and random.random() < 0.7 else None,
+                    coins_balance=coins,
+                    last_seen=now,
+                    boosts_reset_day=day_key(now),
+                )
+                for telegram_id in batch
+            )
+            PlayerTask.objects.bulk_create(
+                PlayerTask(player_id=telegram_id, task_id=task_id) for telegram_id in batch for task_id in task_ids
+            )
+    for start in range(0, players, batch_size):
+        pairs = set()
+        for telegram_id in player_ids[start:start + batch_size]:
+            for friend_id in random.sample(player_ids, min(friends, players - 1)):
+                if friend_id != telegram_id:
+                    # Symmetrical m2m, both directions are stored
+                    pairs.update(((telegram_id, friend_id), (friend_id, telegram_id)))
+        Friendship.objects.bulk_create(
+            (Friendship(from_player_id=a, to_player_id=b) for a, b in pairs), ignore_conflicts=True
+        )
+    # bulk_create doesn't send m2m_changed, count the friendships in one go
+    FriendsProcessor.recount(Player.objects.filter(telegram_id__gte=first_id, telegram_id__lt=first_id + players))
+
+    return load_population(first_id, players)
+
+
+def load_population(first_id: int, players: int) -> dict:
+    """Ids of a seeded population, as the traffic mix picks from them."""
+    player_ids = list(
+        Player.objects.filter(telegram_id__gte=first_id, telegram_id__lt=first_id + players)
+        .order_by("telegram_id")
+        .values_list("telegram_id", flat=True)
+    )
+    return {
+        "players": player_ids,
+        "teams": list(Team.objects.filter(name__startswith=f"{SEED_PREFIX} ").values_list("id", flat=True)),
+        "memes": list(Meme.objects.filter(name__startswith=f"{SEED_PREFIX} ").values_list("id", flat=True)),
+        "tasks": list(Task.objects.filter(name__startswith=f"{SEED_PREFIX} ").values_list("id", flat=True)),
+        "leagues": list(League.objects.values_list("id", flat=True)),
+        "player_tasks": list(
+            PlayerTask.objects.filter(player_id__in=player_ids, status="AV").values_list("id", flat=True)
+        ),
+    }
+
+
+def clear_population(first_id: int, players: int):
+    last_id = first_id + players
+    # Teams first, so deleting the players doesn't update team totals one by one
+    Team.objects.filter(name__startswith=f"{SEED_PREFIX} ").delete()
+    Player.objects.filter(telegram_id__gte=first_id, telegram_id__lt=last_id).delete()
+    OutboundMessage.objects.filter(chat_id__gte=first_id, chat_id__lt=last_id).delete()
+    Meme.objects.filter(name__startswith=f"{SEED_PREFIX} ").delete()
+    Task.objects.filter(name__startswith=f"{SEED_PREFIX} ").delete()
+    League.objects.filter(name__startswith=f"{SEED_PREFIX}-").delete()
+
+
+class VirtualPlayer:
+    """Client-side state of one simulated WebApp session."""
+
+    def __init__(self, telegram_id: int, coins: int):
+        self.telegram_id = telegram_id
+        self.coins = coins
+        self.energy = 1000
+
+
+def tap_sync(player, population):
+    taps = random.randint(20, 200)
+    player.coins += taps
+    player.energy = max(0, player.energy - taps)
+    return "POST", "/update_coins_and_energy/", {
+        "user_id": player.telegram_id, "coins_count": player.coins, "energy_count": player.energy
+    }
+
+
+def complete_task(player, population):
+    # Completing a task someone else already completed is answered with 400,
+    # which is still a realistic request.
+    task_id = random.choice(population["player_tasks"] or [0])
+    return "POST", "/complete_task/", {"task_id": task_id}
+
+
+def user_get(path, **extra):
+    return lambda player, population: (
+        "GET", path, dict({"user_id": player.telegram_id}, **{k: v(population) for k, v in extra.items()})
+    )
+
+
+def user_post(path, **extra):
+    return lambda player, population: (
+        "POST", path, dict({"user_id": player.telegram_id}, **{k: v(population) for k, v in extra.items()})
+    )
+
+
+def pick(key):
+    return lambda population: random.choice(population[key] or [0])
+
+
+# endpoint name -> (weight, request builder). Weights follow a clicker
+# session: tap syncs every few seconds, energy polls, the occasional purchase
+# and leaderboard view.
+TRAFFIC_MIX = {
+    "update_coins_and_energy": (40, tap_sync),
+    "get_player_energy": (15, user_get("/get_player_energy")),
+    "initialize_user": (5, user_get("/initialize_user/")),
+    "bootstrap": (3, user_get("/bootstrap/")),
+    "manage_meme": (5, user_post("/manage_meme/", meme_id=pick("memes"))),
+    "get_player_memes": (4, user_get("/get_player_memes")),
+    "get_league": (4, lambda player, population: (
+        "GET", "/get_league/", {"league": random.choice(population["leagues"]),
+                                "time_period": random.choice(["day", "week"])}
+    )),
+    "get_league_rank": (2, user_get("/get_league_rank/")),
+    "get_top5_teams": (3, lambda player, population: ("GET", "/get_top5_teams/", {})),
+    "get_user_boosts": (3, user_get("/get_user_boosts/")),
+    "get_user_upgrades": (2, user_get("/get_user_upgrades/")),
+    "get_user_tasks": (3, user_get("/get_user_tasks/")),
+    "use_boost": (2, user_post("/use_boost/", boost=lambda population: random.choice(["rocket", "full_energy"]))),
+    "buy_upgrade": (1, user_post("/buy_upgrade/", upgrade=lambda population: random.choice(
+        ["multitap", "rechargingSpeed", "energyLimit"]
+    ))),
+    "complete_task": (1, complete_task),
+    "get_task": (1, lambda player, population: ("GET", "/get_task/", {"task_id": pick("tasks")(population)})),
+    "get_all_leagues": (1, lambda player, population: ("GET", "/get_all_leagues/", {})),
+    "get_teams": (1, lambda player, population: ("GET", "/get_teams/", {"search_query": SEED_PREFIX})),
+    "get_team": (1, lambda player, population: ("GET", "/get_team/", {"team_id": pick("teams")(population)})),
+    "join_team": (1, user_post("/join_team/", team_id=pick("teams"))),
+    "leave_team": (0.5, user_post("/leave_team/")),
+    "friends_list": (1, user_get("/friends_list/")),
+    "friends_reffered_count": (1, user_get("/friends_reffered_count/")),
+    "send_invite": (0.2, user_post("/send_invite_message/")),
+}
+
+
+class InProcessTarget:
+    """Calls the views through Django's test client, counting SQL per request."""
+
+    name = "in-process"
+
+    def __init__(self):
+        self.client = Client(HTTP_HOST="127.0.0.1", raise_request_exception=False)
+
+    def request(self, method: str, path: str, data: dict):
+        """Returns (status, seconds, queries, rows written)."""
+        counter = QueryCounter()
+        start = time.perf_counter()
+        with connection.execute_wrapper(counter):
+            if method == "GET":
+                response = self.client.get(path, data)
+            else:
+                response = self.client.post(path, data)
+        return response.status_code, time.perf_counter() - start, counter.queries, counter.rows_written
+
+    def close(self):
+        connection.close()
+
+
+class HttpTarget:
+    """Calls a running deployment over HTTP; SQL isn't visible from here."""
+
+    name = "http"
+
+    def __init__(self, base_url: str, timeout: float = 30):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def request(self, method: str, path: str, data: dict):
+        start = time.perf_counter()
+        try:
+            if method == "GET":
+                response = self.session.get(self.base_url + path, params=data, timeout=self.timeout)
+            else:
+                response = self.session.post(self.base_url + path, data=data, timeout=self.timeout)
+            status = response.status_code
+        except requests.RequestException:
+            status = 0
+        return status, time.perf_counter() - start, None, None
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import threading
+import time
+from bisect import bisect_right
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from .models import League, Meme, Task
+
+
+class CatalogVersion:
+    """
+    Version tokens for admin-edited catalogs (leagues, memes, ...). The token
+    lives in the CATALOG_CACHE cache so that a shared backend invalidates every
+    worker at once; with the default local-memory cache each process relies on
+    VersionedCatalog.max_age as well.
+    """
+
+    @classmethod
+    def _cache(cls):
+        return caches[settings.CATALOG_CACHE]
+
+    @classmethod
+    def _key(cls, name: str) -> str:
+        return f"catalog_version:{name}"
+
+    @classmethod
+    def get(cls, name: str) -> int:
+        cache = cls._cache()
+        version = cache.get(cls._key(name))
+        if version is None:
+            cache.add(cls._key(name), time.time_ns(), None)
+            version = cache.get(cls._key(name))
+        return version
+
+    @classmethod
+    def bump(cls, name: str):
+        cls._cache().set(cls._key(name), time.time_ns(), None)
+
+    @classmethod
+    def bump_on_commit(cls, name: str):
+        transaction.on_commit(lambda: cls.bump(name))
+
+
+class VersionedCatalog:
+    """Process-local copy of a catalog, reloaded when its version changes."""
+    name: str = None
+    max_age = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._loaded_at = 0.0
+        self._data = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def _stale(self, version) -> bool:
+        return (
+            self._data is None
+            or version != self._version
+            or time.monotonic() - self._loaded_at > self.max_age
+        )
+
+    def get(self):
+        version = CatalogVersion.get(self.name)
+        if self._stale(version):
+            with self._lock:
+                # Threads queued behind the lock find the copy the first one loaded
+                if self._stale(version):
+                    data = self.load()
+                    self._data, self._version, self._loaded_at = data, version, time.monotonic()
+        return self._data
+
+    def invalidate(self):
+        self._data = None
+
+
+class CatalogResponseCache:
+    """
+    Pre-serialized JSON responses of catalog endpoints, stored in the
+    CATALOG_RESPONSE_CACHE cache under the catalog version, so an admin edit
+    switches every reader to a fresh copy. The ETag is a hash of the body:
+    a client sending it back gets a 304 from two cache reads, without touching
+    the database or encoding JSON.
+    """
+    timeout = VersionedCatalog.max_age
+
+    @classmethod
+    def _cache(cls):
+        return caches[settings.CATALOG_RESPONSE_CACHE]
+
+    @classmethod
+    def get(cls, name: str, variant, build):
+        """Returns (body, etag), calling build() for the data on a miss."""
+        variant_hash = hashlib.md5(str(variant).encode()).hexdigest()
+        key = f"catalog_response:{name}:{CatalogVersion.get(name)}:{variant_hash}"
+        entry = cls._cache().get(key)
+        if entry is None:
+            body = json.dumps(build(), cls=DjangoJSONEncoder).encode()
+            entry = (body, f'"{hashlib.md5(body).hexdigest()}"')
+            cls._cache().set(key, entry, cls.timeout)
+        return entry
+
+    @classmethod
+    def respond(cls, request, name: str, variant, build) -> HttpResponse:
+        body, etag = cls.get(name, variant, build)
+        if etag in parse_etags(request.headers.get("If-None-Match", "")):
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(body, content_type="application/json")
+        response["ETag"] = etag
+        # Clients may keep the body but have to revalidate it every time
+        response["Cache-Control"] = "no-cache"
+        return response
+
+
+class LeagueLadder(VersionedCatalog):
+    """
+    Leagues sorted by coin_limit, so a player's league is found with bisect
+    over the thresholds instead of a query per coin update.
+    """
+    name = "league"
+
+    def load(self):
+        leagues = sorted(League.objects.all(), key=lambda league: (league.coin_limit, league.level))
+        return {
+            "thresholds": [league.coin_limit for league in leagues],
+            "leagues": leagues,
+            "by_id": {league.id: league for league in leagues},
+            "by_level": {league.level: league for league in leagues},
+        }
+
+    def resolve(self, total_coins_earned: int):
+        ladder = self.get()
+        index = bisect_right(ladder["thresholds"], total_coins_earned) - 1
+        if index < 0:
+            return None
+        return ladder["leagues"][index]
+
+    def get_league(self, league_id: int):
+        return self.get()["by_id"].get(league_id)
+
+    def get_by_level(self, level: int):
+        return self.get()["by_level"].get(level)
+
+
+class MemeCurve:
+    """
+    Income and stored upgrade cost of a meme at each level, precomputed up to
+    `levels` and computed on demand above. Level 1 earns the base
+    coins_per_hour and every further level earns 1.1 ** level times it; the
+    stored upgrade cost doubles the purchase price per level.
+    """
+    levels = 64
+
+    def __init__(self, coins_per_hour: int, upgrade_price: int):
+        self.coins_per_hour = coins_per_hour
+        self.upgrade_price = upgrade_price
+        self.incomes = [self._income(level) for level in range(self.levels + 1)]
+        self.costs = [upgrade_price * 2**level for level in range(self.levels + 1)]
+
+    def _income(self, level: int) -> int:
+        if level <= 0:
+            return 0
+        if level == 1:
+            return self.coins_per_hour
+        return int(self.coins_per_hour * (1.1**level))
+
+    def income(self, level: int) -> int:
+        return self.incomes[level] if 0 <= level <= self.levels else self._income(level)
+
+    def cost(self, level: int) -> int:
+        return self.costs[level] if 0 <= level <= self.levels else self.upgrade_price * 2**level
+
+
+class MemeCatalog(VersionedCatalog):
+    name = "meme"
+
+    def load(self):
+        memes = list(
+            Meme.objects.order_by("id").values("id", "name", "coins_per_hour", "upgrade_price", "logo")
+        )
+        return {
+            "memes": memes,
+            "curves": {meme["id"]: MemeCurve(meme["coins_per_hour"], meme["upgrade_price"]) for meme in memes},
+        }
+
+    def curve(self, meme: Meme) -> MemeCurve:
+        """The level curve of a loaded meme, built anew if the catalog copy is older."""
+        curve = self.get()["curves"].get(meme.id)
+        if curve is None or (curve.coins_per_hour, curve.upgrade_price) != (meme.coins_per_hour, meme.upgrade_price):
+            curve = MemeCurve(meme.coins_per_hour, meme.upgrade_price)
+        return curve
+
+
+class ActiveTaskCatalog(VersionedCatalog):
+    name = "task"
+
+    def load(self):
+        return frozenset(Task.objects.filter(active=True).values_list("id", flat=True))
+
+
+league_ladder = LeagueLadder()
+meme_catalog = MemeCatalog()
+active_task_catalog = ActiveTaskCatalog()
@@ -0,0 +1,72 @@
+import time
+
+from django.db import connections
+from django.db.models import sql
+
+
+def update_returning(queryset, returning, **values):
+    """
+    queryset.update(**values) as a single UPDATE ... RETURNING statement.
+    Returns the returning fields of the first updated row as a dict, or None
+    when the filter matched nothing. Meant for conditional single-row updates
+    such as debiting a balance only if it covers the cost.
+    """
+    query = queryset.query.chain(sql.UpdateQuery)
+    query.add_update_values(values)
+    compiler = query.get_compiler(queryset.db)
+    compiler.pre_sql_setup()
+    update_sql, params = compiler.as_sql()
+    connection = connections[queryset.db]
+    columns = ", ".join(
+        connection.ops.quote_name(queryset.model._meta.get_field(field).column) for field in returning
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(f"{update_sql} RETURNING {columns}", params)
+        row = cursor.fetchone()
+    if row is None:
+        return None
+    return dict(zip(returning, row))
+
+
+def insert_from(queryset, model, **values):
+    """
+    INSERT INTO model's table one row per row of queryset, as a single
+    INSERT ... SELECT statement. values maps model fields to expressions over
+    the queryset's rows. Returns how many rows were inserted.
+    """
+    aliases = {f"insert_{field}": value for field, value in values.items()}
+    select_sql, params = queryset.annotate(**aliases).values_list(*aliases).query.sql_with_params()
+    connection = connections[queryset.db]
+    columns = ", ".join(
+        connection.ops.quote_name(model._meta.get_field(field).column) for field in values
+    )
+    table = connection.ops.quote_name(model._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(f"INSERT INTO {table} ({columns}) {select_sql}", params)
+        return cursor.rowcount
+
+
+def pk_chunks(queryset, chunk_size: int, sleep: float = 0):
+    """
+    Yields queryset restricted to consecutive primary key ranges of about
+    chunk_size rows, in key order, so a job updating a whole table touches a
+    bounded number of rows per statement. Sleeps between chunks if asked.
+    """
+    model = queryset.model
+    last_id = None
+    while True:
+        keys = model.objects.order_by("pk")
+        if last_id is not None:
+            keys = keys.filter(pk__gt=last_id)
+        upper = keys.values_list("pk", flat=True)[chunk_size - 1:chunk_size].first()
+        chunk = queryset
+        if last_id is not None:
+            chunk = chunk.filter(pk__gt=last_id)
+        if upper is not None:
+            chunk = chunk.filter(pk__lte=upper)
+        yield chunk
+        if upper is None:
+            break
+        last_id = upper
+        if sleep:
+            time.sleep(sleep)
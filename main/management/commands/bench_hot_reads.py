@@ -0,0 +1,78 @@
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+from urllib.parse import urlencode
+
+from django.core.management.base import BaseCommand
+
+from main.benchmarks import AsyncHttpClient, summarize
+
+HOT_READS = [
+    "/initialize_user/",
+    "/get_user_boosts/",
+    "/get_user_upgrades/",
+    "/get_player_energy",
+    "/friends_list/",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate many Telegram WebApp clients opening the game at the same moment: each "
+        "client fires the hot read endpoints once, all clients start together. Run it "
+        "against a WSGI deployment and an ASGI one (ASYNC_HOT_READS=1) to compare."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+        parser.add_argument("--clients", type=int, default=500)
+        parser.add_argument("--user-ids", default="1-1000", help="Range of existing telegram ids, e.g. 1-1000.")
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument("--json", dest="json_path", help="Also write the report to this file.")
+
+    def handle(self, *args, **options):
+        first, _, last = options["user_ids"].partition("-")
+        user_ids = range(int(first), int(last or first) + 1)
+        report = asyncio.run(self.run(options, user_ids))
+        output = json.dumps(report, indent=2)
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    async def run(self, options, user_ids):
+        client = AsyncHttpClient(options["base_url"], timeout=options["timeout"])
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+
+        async def open_game(user_id):
+            # A WebApp fires its initial reads in parallel
+            await asyncio.gather(*[call(path, user_id) for path in HOT_READS])
+
+        async def call(path, user_id):
+            try:
+                status, _, seconds = await client.request("GET", f"{path}?{urlencode({'user_id': user_id})}")
+            except (OSError, asyncio.TimeoutError):
+                errors[path] += 1
+                return
+            if status >= 400:
+                errors[path] += 1
+            else:
+                latencies[path].append(seconds)
+
+        start = time.perf_counter()
+        await asyncio.gather(*[open_game(random.choice(user_ids)) for _ in range(options["clients"])])
+        elapsed = time.perf_counter() - start
+
+        all_latencies = [seconds for path in HOT_READS for seconds in latencies[path]]
+        return {
+            "base_url": options["base_url"],
+            "clients": options["clients"],
+            "elapsed_s": round(elapsed, 3),
+            "total": dict(summarize(all_latencies, elapsed), errors=sum(errors.values())),
+            "endpoints": {
+                path: dict(summarize(latencies[path], elapsed), errors=errors[path]) for path in HOT_READS
+            },
+        }
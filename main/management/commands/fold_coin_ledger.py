@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from main.processors import LedgerProcessor
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold coin ledger credits into player balances, one batch per transaction, "
+        "and move the folded rows to the ledger archive. Several workers can run "
+        "side by side, each claims its own batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument("--once", action="store_true", help="Exit once the ledger is empty.")
+
+    def handle(self, *args, **options):
+        folded = 0
+        while True:
+            count = LedgerProcessor.fold(options["batch_size"])
+            folded += count
+            if count:
+                continue
+            if options["once"]:
+                break
+            close_old_connections()
+            time.sleep(options["poll_interval"])
+        self.stdout.write(f"Folded {folded} ledger entries.")
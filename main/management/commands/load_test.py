@@ -0,0 +1,182 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.test.utils import override_settings
+
+from main.benchmarks import (
+    TRAFFIC_MIX,
+    HttpTarget,
+    InProcessTarget,
+    VirtualPlayer,
+    clear_population,
+    load_population,
+    seed_population,
+    summarize,
+)
+from main.player_cache import player_state_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a synthetic population and replay a clicker traffic mix against every "
+        "endpoint, in-process through the test client or over HTTP against a running "
+        "deployment. Reports throughput, latency percentiles and, in-process, SQL "
+        "queries and rows written per endpoint. Only runs against LOAD_TEST_DB_NAME or "
+        "under a dedicated --settings module; seeded players use a reserved telegram id "
+        "range and are removed with --cleanup. Telegram messages go to the in-memory "
+        "transport."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--base-url", help="Replay over HTTP against this deployment instead of in-process.")
+        parser.add_argument("--players", type=int, default=1000)
+        parser.add_argument("--teams", type=int, default=50)
+        parser.add_argument("--memes", type=int, default=10)
+        parser.add_argument("--tasks", type=int, default=5)
+        parser.add_argument("--friends", type=int, default=5, help="Friends per seeded player.")
+        parser.add_argument("--coins", type=int, default=50_000_000, help="Starting balance of seeded players.")
+        parser.add_argument("--first-id", type=int, default=9_000_000_000_000, help="First seeded telegram id.")
+        parser.add_argument("--no-seed", action="store_true", help="Reuse a population seeded by an earlier run.")
+        parser.add_argument("--cleanup", action="store_true", help="Delete the seeded population afterwards.")
+        parser.add_argument("--concurrency", type=int, default=8, help="Simulated clients running at once.")
+        parser.add_argument("--duration", type=float, default=30, help="Seconds to replay traffic for.")
+        parser.add_argument("--requests", type=int, help="Stop after this many requests instead.")
+        parser.add_argument("--mix", help="Override weights, e.g. update_coins_and_energy=80,get_league=0.")
+        parser.add_argument("--timeout", type=float, default=30)
+        parser.add_argument("--json", dest="json_path", help="Also write the report to this file.")
+
+    def handle(self, *args, **options):
+        mix = self.traffic_mix(options["mix"])
+        self.use_load_test_database()
+        # Whatever the settings say, nothing reaches real chats
+        with override_settings(TELEGRAM_TRANSPORT="main.telegram.MemoryTransport"):
+            report = self.run(options, mix)
+
+        output = json.dumps(report, indent=2)
+        if options["json_path"]:
+            with open(options["json_path"], "w") as f:
+                f.write(output)
+        self.stdout.write(output)
+
+    def use_load_test_database(self):
+        if settings.LOAD_TEST_DB_NAME:
+            # Repointed the way the test runner switches to its test database
+            connection.close()
+            settings.DATABASES[DEFAULT_DB_ALIAS]["NAME"] = settings.LOAD_TEST_DB_NAME
+            connection.settings_dict["NAME"] = settings.LOAD_TEST_DB_NAME
+        elif settings.SETTINGS_MODULE == "coin.settings":
+            raise CommandError(
+                "Refusing to seed the production database. Set LOAD_TEST_DB_NAME to a "
+                "dedicated database or pass --settings with a load testing settings module."
+            )
+
+    def run(self, options, mix):
+        if options["no_seed"]:
+            population = load_population(options["first_id"], options["players"])
+        else:
+            population = seed_population(
+                options["first_id"], options["players"], options["teams"], options["memes"],
+                options["tasks"], options["friends"], options["coins"],
+            )
+        # Seeding committed on this thread's connection, replay opens its own
+        connection.close()
+        if not population["players"]:
+            raise CommandError("No seeded players found, run without --no-seed first.")
+
+        try:
+            return self.replay(options, population, mix)
+        finally:
+            if options["cleanup"]:
+                clear_population(options["first_id"], options["players"])
+
+    def traffic_mix(self, overrides):
+        weights = {name: weight for name, (weight, _) in TRAFFIC_MIX.items()}
+        for item in filter(None, (overrides or "").split(",")):
+            name, _, weight = item.partition("=")
+            if name not in weights:
+                raise CommandError(f"Unknown endpoint {name!r}, choose from {', '.join(TRAFFIC_MIX)}.")
+            weights[name] = float(weight)
+        return {name: weight for name, weight in weights.items() if weight > 0}
+
+    def replay(self, options, population, mix):
+        players = [VirtualPlayer(telegram_id, options["coins"]) for telegram_id in population["players"]]
+        names, weights = list(mix), list(mix.values())
+        stats = defaultdict(lambda: {"latencies": [], "errors": 0, "queries": 0, "rows_written": 0})
+        stats_lock = threading.Lock()
+        budget = [options["requests"]]
+        deadline = time.perf_counter() + options["duration"]
+
+        def take_request():
+            if budget[0] is None:
+                return time.perf_counter() < deadline
+            with stats_lock:
+                budget[0] -= 1
+                return budget[0] >= 0
+
+        def client():
+            target = HttpTarget(options["base_url"], options["timeout"]) if options["base_url"] else InProcessTarget()
+            local = defaultdict(lambda: {"latencies": [], "errors": 0, "queries": 0, "rows_written": 0})
+            try:
+                while take_request():
+                    name = random.choices(names, weights)[0]
+                    method, path, data = TRAFFIC_MIX[name][1](random.choice(players), population)
+                    status, seconds, queries, rows_written = target.request(method, path, data)
+                    endpoint = local[name]
+                    if status == 0 or status >= 500:
+                        endpoint["errors"] += 1
+                        continue
+                    endpoint["latencies"].append(seconds)
+                    endpoint["queries"] += queries or 0
+                    endpoint["rows_written"] += rows_written or 0
+            finally:
+                target.close()
+            with stats_lock:
+                for name, endpoint in local.items():
+                    stats[name]["latencies"] += endpoint["latencies"]
+                    for key in ("errors", "queries", "rows_written"):
+                        stats[name][key] += endpoint[key]
+
+        threads = [threading.Thread(target=client) for _ in range(options["concurrency"])]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        in_process = not options["base_url"]
+        endpoints = {}
+        for name in sorted(stats, key=lambda name: -len(stats[name]["latencies"])):
+            endpoint = stats[name]
+            served = len(endpoint["latencies"])
+            summary = dict(summarize(endpoint["latencies"], elapsed), errors=endpoint["errors"])
+            if in_process:
+                summary["queries_per_request"] = round(endpoint["queries"] / served, 2) if served else 0.0
+                summary["rows_written_per_request"] = round(endpoint["rows_written"] / served, 2) if served else 0.0
+            endpoints[name] = summary
+
+        all_latencies = [seconds for endpoint in stats.values() for seconds in endpoint["latencies"]]
+        total = dict(summarize(all_latencies, elapsed), errors=sum(endpoint["errors"] for endpoint in stats.values()))
+        if in_process:
+            total["queries"] = sum(endpoint["queries"] for endpoint in stats.values())
+            total["rows_written"] = sum(endpoint["rows_written"] for endpoint in stats.values())
+            total["player_cache"] = player_state_cache.stats()
+        return {
+            "target": options["base_url"] or InProcessTarget.name,
+            "database": f"{connection.vendor}:{connection.settings_dict['NAME']}",
+            # Write-behind flushes happen on a background thread and aren't
+            # attributed to the tap sync requests that queued them.
+            "write_behind": settings.PLAYER_SYNC_WRITE_BEHIND,
+            "players": len(players),
+            "concurrency": options["concurrency"],
+            "elapsed_s": round(elapsed, 3),
+            "mix": mix,
+            "total": total,
+            "endpoints": endpoints,
+        }
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from main.processors import ReferralProcessor
+
+
+class Command(BaseCommand):
+    help = (
+        "Pay referral commissions on recorded earnings, one batch per transaction. "
+        "Several workers can run side by side, each claims its own batch."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument("--poll-interval", type=float, default=5.0)
+        parser.add_argument("--once", action="store_true", help="Exit once no earnings are waiting.")
+
+    def handle(self, *args, **options):
+        processed = 0
+        while True:
+            count = ReferralProcessor.pay_batch(options["batch_size"])
+            processed += count
+            if count:
+                continue
+            if options["once"]:
+                break
+            close_old_connections()
+            time.sleep(options["poll_interval"])
+        self.stdout.write(f"Paid commissions on {processed} earnings.")
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from main.models import League
+from main.processors import LeagueRankProcessor
+
+
+class Command(BaseCommand):
+    help = "Rebuild the per-league rank snapshot used by get_league_rank."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--league", type=int, action="append", help="League id, can be repeated. Defaults to all.")
+        parser.add_argument("--batch-size", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        league_ids = options["league"] or list(League.objects.order_by("level").values_list("id", flat=True))
+        for league_id in league_ids:
+            count = LeagueRankProcessor.rebuild(league_id, batch_size=options["batch_size"])
+            self.stdout.write(f"League {league_id}: ranked {count} players.")
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from main.models import Player, MemePlayer
+from main.player_cache import player_state_cache
+from main.processors import MemeProcessor
+
+
+class Command(BaseCommand):
+    help = "Recompute Player.total_coins_per_hour from MemePlayer rows and fix any drift."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=5000)
+        parser.add_argument("--dry-run", action="store_true", help="Only report drifted players.")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        dry_run = options["dry_run"]
+        checked = drifted = 0
+        last_id = None
+
+        while True:
+            players = Player.objects.order_by("telegram_id")
+            if last_id is not None:
+                players = players.filter(telegram_id__gt=last_id)
+            chunk = list(players.values_list("telegram_id", "total_coins_per_hour")[:chunk_size])
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            checked += len(chunk)
+
+            totals = dict(
+                MemePlayer.objects.filter(player_id__in=[telegram_id for telegram_id, _ in chunk])
+                .order_by()
+                .values("player_id")
+                .annotate(total=Sum("current_coins_per_hour"))
+                .values_list("player_id", "total")
+            )
+            drifted_ids = [
+                telegram_id
+                for telegram_id, stored in chunk
+                if stored != totals.get(telegram_id, 0)
+            ]
+            drifted += len(drifted_ids)
+
+            if drifted_ids and not dry_run:
+                # Recompute inside the UPDATE so purchases made since the
+                # aggregate above are not overwritten with a stale total.
+                Player.objects.filter(telegram_id__in=drifted_ids).update(
+                    total_coins_per_hour=MemeProcessor.owned_income()
+                )
+                player_state_cache.invalidate(drifted_ids)
+
+        action = "found" if dry_run else "fixed"
+        self.stdout.write(f"Checked {checked} players, {action} {drifted} with drifted coins per hour.")
@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.models import Player
+from main.processors import MAX_BOOSTS_COUNT, PlayerProcessor, day_key
+
+
+class Command(BaseCommand):
+    help = (
+        "Refill daily boosts of every player not refilled yet today. Runs in primary key "
+        "chunks so each UPDATE touches a bounded number of rows; schedule it right after "
+        "the game day starts. Sessions refill lazily as well, so a late or partial run "
+        "is harmless."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=10000)
+        parser.add_argument("--sleep", type=float, default=0, help="Pause between chunks, in seconds.")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        today = day_key(time.time())
+        refilled = 0
+
+        for chunk in PlayerProcessor.update_in_chunks(Player.objects.all(), chunk_size, options["sleep"]):
+            refilled += chunk.filter(boosts_reset_day__lt=today).update(
+                rocket_count=MAX_BOOSTS_COUNT,
+                full_energy_count=MAX_BOOSTS_COUNT,
+                boosts_reset_day=today,
+            )
+
+        self.stdout.write(f"Refilled boosts of {refilled} players.")
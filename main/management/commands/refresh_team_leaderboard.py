@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Sum
+
+from main.models import Player, Team
+from main.processors import TeamProcessor
+
+
+class Command(BaseCommand):
+    help = "Rebuild the team leaderboard snapshot, optionally reconciling Team.coins_count first."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--reconcile", action="store_true", help="Recompute team totals from their members.")
+        parser.add_argument("--chunk-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if options["reconcile"]:
+            drifted = self.reconcile(options["chunk_size"])
+            self.stdout.write(f"Fixed {drifted} teams with drifted coins count.")
+        teams = TeamProcessor.refresh_leaderboard()
+        self.stdout.write(f"Team leaderboard refreshed with {len(teams)} teams.")
+
+    def reconcile(self, chunk_size: int) -> int:
+        drifted = 0
+        last_id = 0
+        while True:
+            chunk = list(
+                Team.objects.filter(id__gt=last_id)
+                .order_by("id")
+                .values_list("id", "coins_count")[:chunk_size]
+            )
+            if not chunk:
+                break
+            last_id = chunk[-1][0]
+            totals = dict(
+                Player.objects.filter(team_id__in=[team_id for team_id, _ in chunk])
+                .order_by()
+                .values("team_id")
+                .annotate(total=Sum("total_coins_earned"))
+                .values_list("team_id", "total")
+            )
+            drifted_ids = [team_id for team_id, stored in chunk if stored != totals.get(team_id, 0)]
+            if drifted_ids:
+                Team.objects.filter(id__in=drifted_ids).update(coins_count=TeamProcessor.members_total())
+                drifted += len(drifted_ids)
+        return drifted
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from main.models import Meme
+from main.processors import MemeProcessor
+
+
+class Command(BaseCommand):
+    help = (
+        "Move owned memes onto their meme's current income and upgrade cost curve and "
+        "recompute the owners' coins per hour. Saving a meme reprices it already; this "
+        "catches up rows priced before that, or changed with queryset updates."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--meme-id", type=int, action="append", help="Only reprice these memes.")
+
+    def handle(self, *args, **options):
+        memes = Meme.objects.order_by("id")
+        if options["meme_id"]:
+            memes = memes.filter(id__in=options["meme_id"])
+        repriced = 0
+        for meme in memes:
+            repriced += MemeProcessor.reprice(meme)
+        self.stdout.write(f"Repriced {repriced} owned memes.")
@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from main.models import Player
+from main.processors import PlayerProcessor, day_key, week_key
+
+
+class Command(BaseCommand):
+    help = (
+        "Zero day/week earnings left over from previous periods. Leaderboards already "
+        "ignore stale counters, so this only keeps the stored values tidy and can run "
+        "at any time in small chunks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=10000)
+        parser.add_argument("--sleep", type=float, default=0, help="Pause between chunks, in seconds.")
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        today = day_key(time.time())
+        this_week = week_key(today)
+        reset_days = reset_weeks = 0
+
+        for chunk in PlayerProcessor.update_in_chunks(Player.objects.all(), chunk_size, options["sleep"]):
+            reset_days += chunk.filter(earned_day_key__lt=today).update(
+                total_earned_day=0, earned_day_key=today
+            )
+            reset_weeks += chunk.filter(earned_week_key__lt=this_week).update(
+                total_earned_week=0, earned_week_key=this_week
+            )
+
+        self.stdout.write(f"Reset {reset_days} day and {reset_weeks} week earnings counters.")
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+
+from main.telegram import OutboundQueue, RateLimiter, get_transport
+
+
+class Command(BaseCommand):
+    help = "Deliver queued Telegram messages, respecting the bot API rate limit."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=100)
+        parser.add_argument("--poll-interval", type=float, default=1.0)
+        parser.add_argument("--once", action="store_true", help="Exit once no message is due.")
+
+    def handle(self, *args, **options):
+        try:
+            transport = get_transport()
+        except ImproperlyConfigured as e:
+            raise CommandError(str(e))
+        rate_limiter = RateLimiter(settings.TELEGRAM_RATE_LIMIT)
+        processed = 0
+        while True:
+            count = OutboundQueue.drain(transport, rate_limiter, batch_size=options["batch_size"])
+            processed += count
+            if count:
+                continue
+            if options["once"]:
+                break
+            close_old_connections()
+            time.sleep(options["poll_interval"])
+        self.stdout.write(f"Processed {processed} messages.")
@@ -0,0 +1,204 @@
+"""
+Per-view request metrics: count, latency histogram, SQL queries, DB time,
+rows returned and response bytes, kept in process memory and exposed in the
+Prometheus text format by the metrics view. Each worker process keeps its own
+numbers; Prometheus sums them per instance.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.http import Http404, HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# Latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class QueryRecorder:
+    """
+    connection.execute_wrapper callable for one request: counts statements,
+    DB time and rows returned, and remembers the slowest statement.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+        self.rows = 0
+        self.slowest = (0.0, None)
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - start
+            self.queries += 1
+            self.duration += duration
+            if duration > self.slowest[0]:
+                self.slowest = (duration, sql)
+            if context["cursor"].description is not None:
+                self.rows += max(context["cursor"].rowcount, 0)
+
+
+class ViewStats:
+    __slots__ = ("statuses", "buckets", "latency", "queries", "db_time", "rows", "bytes")
+
+    def __init__(self):
+        self.statuses = defaultdict(int)
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.latency = 0.0
+        self.queries = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.views = defaultdict(ViewStats)
+        self.lock = threading.Lock()
+        # Callables returning extra exposition lines, e.g. cache counters
+        self.collectors = []
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def record(self, view: str, status: int, seconds: float, recorder: QueryRecorder = None, size: int = 0):
+        with self.lock:
+            stats = self.views[view]
+            stats.statuses[f"{status // 100}xx"] += 1
+            stats.buckets[bisect_left(BUCKETS, seconds)] += 1
+            stats.latency += seconds
+            stats.bytes += size
+            if recorder is not None:
+                stats.queries += recorder.queries
+                stats.db_time += recorder.duration
+                stats.rows += recorder.rows
+
+    def reset(self):
+        with self.lock:
+            self.views.clear()
+
+    def render(self) -> str:
+        with self.lock:
+            views = sorted(self.views.items())
+            lines = [
+                "# HELP coin_http_requests_total Requests served, by view and status class.",
+                "# TYPE coin_http_requests_total counter",
+            ]
+            for view, stats in views:
+                for status, count in sorted(stats.statuses.items()):
+                    lines.append(f'coin_http_requests_total{{view="{view}",status="{status}"}} {count}')
+
+            lines += [
+                "# HELP coin_http_request_duration_seconds Request latency, by view.",
+                "# TYPE coin_http_request_duration_seconds histogram",
+            ]
+            for view, stats in views:
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), stats.buckets):
+                    cumulative += count
+                    lines.append(f'coin_http_request_duration_seconds_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                lines.append(f'coin_http_request_duration_seconds_sum{{view="{view}"}} {stats.latency:.6f}')
+                lines.append(f'coin_http_request_duration_seconds_count{{view="{view}"}} {cumulative}')
+
+            for name, help_text, attribute, fmt in (
+                ("coin_db_queries_total", "SQL statements executed, by view.", "queries", "{}"),
+                ("coin_db_query_duration_seconds_total", "Time spent in SQL, by view.", "db_time", "{:.6f}"),
+                ("coin_db_rows_returned_total", "Rows returned by SQL queries, by view.", "rows", "{}"),
+                ("coin_http_response_bytes_total", "Response body bytes, by view.", "bytes", "{}"),
+            ):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                for view, stats in views:
+                    lines.append(f'{name}{{view="{view}"}} {fmt.format(getattr(stats, attribute))}')
+        for collector in self.collectors:
+            lines += collector()
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+def view_name(request) -> str:
+    match = getattr(request, "resolver_match", None)
+    if match is None:
+        return "unmatched"
+    return match.url_name or match.view_name
+
+
+def response_size(response) -> int:
+    return 0 if response.streaming else len(response.content)
+
+
+class MetricsMiddleware:
+    """
+    Records every request in the registry. Sync views also get their SQL
+    counted through connection.execute_wrapper; async views share database
+    connections between requests, so only latency and size are recorded.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        recorder = QueryRecorder()
+        start = time.perf_counter()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - start, recorder)
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - start)
+        return response
+
+    def record(self, request, response, seconds: float, recorder: QueryRecorder = None):
+        view = view_name(request)
+        registry.record(view, response.status_code, seconds, recorder, response_size(response))
+        if settings.SLOW_REQUEST_MS and seconds * 1000 >= settings.SLOW_REQUEST_MS:
+            slowest_time, slowest_sql = recorder.slowest if recorder else (0.0, None)
+            logger.warning(
+                "Slow request %s %s (%s): %.0f ms, %s queries, %.0f ms in SQL, slowest %.0f ms: %s",
+                request.method,
+                request.path,
+                view,
+                seconds * 1000,
+                recorder.queries if recorder else "?",
+                recorder.duration * 1000 if recorder else 0,
+                slowest_time * 1000,
+                (slowest_sql or "")[:1000],
+            )
+
+
+LOOPBACK_ADDRESSES = {"127.0.0.1", "::1"}
+
+
+def metrics(request):
+    if not settings.METRICS_ENABLED:
+        raise Http404
+    if settings.METRICS_TOKEN:
+        if request.headers.get("Authorization") != f"Bearer {settings.METRICS_TOKEN}":
+            return HttpResponseForbidden()
+    elif request.META.get("REMOTE_ADDR") not in LOOPBACK_ADDRESSES:
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
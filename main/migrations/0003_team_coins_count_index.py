@@ -0,0 +1,34 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:21
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_team_coins_count(apps, schema_editor):
+    Team = apps.get_model("main", "Team")
+    Player = apps.get_model("main", "Player")
+    members_total = (
+        Player.objects.filter(team=OuterRef("pk"))
+        .order_by()
+        .values("team")
+        .annotate(total=Sum("total_coins_earned"))
+        .values("total")
+    )
+    Team.objects.update(coins_count=Coalesce(Subquery(members_total), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_player_created_at'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='team',
+            name='coins_count',
+            field=models.BigIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(fill_team_coins_count, migrations.RunPython.noop),
+    ]
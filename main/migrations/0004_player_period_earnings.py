@@ -0,0 +1,31 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_team_coins_count_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='earned_day_key',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='earned_week_key',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['league', 'earned_day_key', '-total_earned_day', '-telegram_id'], name='player_league_day_rank_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(fields=['league', 'earned_week_key', '-total_earned_week', '-telegram_id'], name='player_league_week_rank_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0004_player_period_earnings'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LeagueRank',
+            fields=[
+                ('player', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='league_rank', serialize=False, to='main.player')),
+                ('rank', models.IntegerField()),
+                ('total_coins_earned', models.BigIntegerField(default=0)),
+                ('league', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.league')),
+            ],
+            options={
+                'unique_together': {('league', 'rank')},
+            },
+        ),
+    ]
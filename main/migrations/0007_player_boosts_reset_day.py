@@ -0,0 +1,28 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:34
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_boosts_reset_day(apps, schema_editor):
+    # Boosts used to be refilled on the first session of a game day, so the
+    # day of last_seen is the day they were last refilled. Same arithmetic as
+    # processors.day_key, with the game timezone offset frozen at UTC+2.
+    Player = apps.get_model("main", "Player")
+    Player.objects.update(boosts_reset_day=(F("last_seen") + 7200) / 86400)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0006_outboundmessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='boosts_reset_day',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_boosts_reset_day, migrations.RunPython.noop),
+    ]
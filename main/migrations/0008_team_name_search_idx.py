@@ -0,0 +1,32 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:39
+
+from django.db import migrations, models
+from django.db.models.functions import Collate, Upper
+
+
+def search_index(vendor):
+    # The "C" collation is Postgres-only; elsewhere a plain UPPER(name) index
+    # still serves the prefix match.
+    search_name = Collate(Upper("name"), "C") if vendor == "postgresql" else Upper("name")
+    return models.Index(search_name, "id", name="team_name_search_idx")
+
+
+def create_search_index(apps, schema_editor):
+    Team = apps.get_model("main", "Team")
+    schema_editor.add_index(Team, search_index(schema_editor.connection.vendor))
+
+
+def drop_search_index(apps, schema_editor):
+    Team = apps.get_model("main", "Team")
+    schema_editor.remove_index(Team, search_index(schema_editor.connection.vendor))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_player_boosts_reset_day'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
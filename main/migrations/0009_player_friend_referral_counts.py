@@ -0,0 +1,54 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:42
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counts(apps, schema_editor):
+    Player = apps.get_model("main", "Player")
+    Friendship = Player.friends.through
+    Player.objects.update(
+        friends_count=Coalesce(
+            Subquery(
+                Friendship.objects.filter(from_player_id=OuterRef("pk"))
+                .exclude(to_player_id=OuterRef("pk"))
+                .order_by()
+                .values("from_player_id")
+                .annotate(count=Count("*"))
+                .values("count")
+            ),
+            Value(0),
+        ),
+        referrals_count=Coalesce(
+            Subquery(
+                Player.objects.filter(referred_by=OuterRef("pk"))
+                .order_by()
+                .values("referred_by")
+                .annotate(count=Count("*"))
+                .values("count")
+            ),
+            Value(0),
+        ),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_team_name_search_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='friends_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='referrals_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:44
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_player_friend_referral_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferralEarning',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('coins', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.player')),
+            ],
+        ),
+    ]
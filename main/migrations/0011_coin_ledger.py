@@ -0,0 +1,36 @@
+# Generated by Django 4.2.11 on 2026-10-18 10:49
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0010_referralearning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoinLedgerArchive',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.BigIntegerField()),
+                ('reason', models.CharField(choices=[('TA', 'Task reward'), ('UP', 'Upgrade'), ('ME', 'Meme')], max_length=2)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('applied_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.player')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CoinLedger',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.BigIntegerField()),
+                ('reason', models.CharField(choices=[('TA', 'Task reward'), ('UP', 'Upgrade'), ('ME', 'Meme')], max_length=2)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.player')),
+            ],
+        ),
+    ]
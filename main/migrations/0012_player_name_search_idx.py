@@ -0,0 +1,31 @@
+# Generated by Django 4.2.11 on 2026-10-18 12:05
+
+from django.db import migrations, models
+from django.db.models.functions import Collate, Upper
+
+
+def search_index(vendor):
+    # Same expression as team_name_search_idx (migration 0008).
+    search_name = Collate(Upper("name"), "C") if vendor == "postgresql" else Upper("name")
+    return models.Index(search_name, name="player_name_search_idx")
+
+
+def create_search_index(apps, schema_editor):
+    Player = apps.get_model("main", "Player")
+    schema_editor.add_index(Player, search_index(schema_editor.connection.vendor))
+
+
+def drop_search_index(apps, schema_editor):
+    Player = apps.get_model("main", "Player")
+    schema_editor.remove_index(Player, search_index(schema_editor.connection.vendor))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_coin_ledger'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0013_coinledger_referral_reason'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='coinledger',
+            name='reason',
+            field=models.CharField(choices=[('TA', 'Task reward'), ('UP', 'Upgrade'), ('ME', 'Meme'), ('RE', 'Referral commission'), ('PI', 'Passive income')], max_length=2),
+        ),
+        migrations.AlterField(
+            model_name='coinledgerarchive',
+            name='reason',
+            field=models.CharField(choices=[('TA', 'Task reward'), ('UP', 'Upgrade'), ('ME', 'Meme'), ('RE', 'Referral commission'), ('PI', 'Passive income')], max_length=2),
+        ),
+    ]
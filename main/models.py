@@ -1,20 +1,83 @@
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils import timezone
 import time
 
 def CURRENT_TIME(): int(time.time())
 
+
+class TrackedFieldsModel(models.Model):
+    """
+    Remembers the column values a row was loaded with, so that save() on a
+    loaded instance updates only the columns that changed, and skips the
+    UPDATE entirely when nothing did.
+    """
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def get_dirty_fields(self):
+        loaded = self._loaded_values
+        return [
+            field.attname
+            for field in self._meta.concrete_fields
+            if not field.primary_key
+            and field.attname in self.__dict__
+            and (field.attname not in loaded or loaded[field.attname] != self.__dict__[field.attname])
+        ]
+
+    def refresh_from_db(self, using=None, fields=None):
+        super().refresh_from_db(using=using, fields=fields)
+        if hasattr(self, "_loaded_values"):
+            self._snapshot(fields)
+
+    def save(self, *args, **kwargs):
+        tracked = (
+            not self._state.adding
+            and hasattr(self, "_loaded_values")
+            and not args
+            and kwargs.get("update_fields") is None
+            and not kwargs.get("force_insert")
+        )
+        if tracked:
+            kwargs["update_fields"] = self.get_dirty_fields()
+        super().save(*args, **kwargs)
+        if hasattr(self, "_loaded_values"):
+            self._snapshot(kwargs.get("update_fields"))
+        else:
+            self._loaded_values = {}
+            self._snapshot()
+
+    def _snapshot(self, fields=None):
+        for field in self._meta.concrete_fields:
+            if fields is not None and field.name not in fields and field.attname not in fields:
+                continue
+            if field.attname in self.__dict__:
+                self._loaded_values[field.attname] = self.__dict__[field.attname]
+
+
 class Team(models.Model):
     name = models.CharField(max_length=100)
-    coins_count = models.IntegerField(default=0)
+    coins_count = models.BigIntegerField(default=0, db_index=True)
     channel_link = models.CharField(max_length=100, default="")
     logo = models.CharField(max_length=1023, null=True, blank=True)
 
+    # team_name_search_idx serves the case-insensitive prefix search. It is
+    # created by migration 0008 rather than declared here because its "C"
+    # collation, under which one btree serves both LIKE 'PREFIX%' and the
+    # ordered keyset scan, only exists on Postgres.
+
     def __str__(self):
         return self.name
 
 
-class Player(models.Model):
+class Player(TrackedFieldsModel):
     telegram_id = models.BigIntegerField(primary_key=True)
     name = models.CharField(max_length=100)
     league = models.ForeignKey("League", on_delete=models.SET_NULL, null=True, blank=True)
@@ -33,18 +96,27 @@ class Player(models.Model):
     last_seen = models.BigIntegerField(default=CURRENT_TIME, blank=True)
     total_earned_day = models.IntegerField(default=0, validators=[MinValueValidator(0)])
     total_earned_week = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    earned_day_key = models.IntegerField(default=0)
+    earned_week_key = models.IntegerField(default=0)
+    # Game day (see processors.day_key) the daily boosts were last refilled on
+    boosts_reset_day = models.IntegerField(default=0)
     total_coins_per_hour = models.IntegerField(default=0, validators=[MinValueValidator(0)])
+    # Kept up to date by the friends/referred_by signals in signals.py
+    friends_count = models.IntegerField(default=0)
+    referrals_count = models.IntegerField(default=0)
     created_at = models.DateTimeField(null=True)
 
-    def save(self, *args, **kwargs):
-        # if not self._state.adding:
-        #     db_instance = Player.objects.get(pk=self.pk)
-        #     if self.coins_balance > db_instance.coins_balance:
-        #         difference = self.coins_balance - db_instance.coins_balance
-        #         self.total_coins_earned += difference
-        super().save(*args, **kwargs)
-        if self.friends.filter(pk=self.pk).exists():
-            self.friends.remove(self)
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["league", "earned_day_key", "-total_earned_day", "-telegram_id"],
+                name="player_league_day_rank_idx",
+            ),
+            models.Index(
+                fields=["league", "earned_week_key", "-total_earned_week", "-telegram_id"],
+                name="player_league_week_rank_idx",
+            ),
+        ]
 
 
 class League(models.Model):
@@ -54,6 +126,21 @@ class League(models.Model):
     logo = models.CharField(max_length=1023, null=True, blank=True)
 
 
+class LeagueRank(models.Model):
+    """
+    Periodically rebuilt position of every player inside their league, ordered
+    by total_coins_earned. Lets rank lookups use an index instead of ordering
+    the whole league.
+    """
+    player = models.OneToOneField(Player, on_delete=models.CASCADE, primary_key=True, related_name="league_rank")
+    league = models.ForeignKey(League, on_delete=models.CASCADE)
+    rank = models.IntegerField()
+    total_coins_earned = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("league", "rank")
+
+
 class Task(models.Model):
     name = models.CharField(max_length=100)  #
     coins_reward = models.IntegerField(default=10000)  #
@@ -65,7 +152,7 @@ class Task(models.Model):
     active = models.BooleanField(default=True)
 
 
-class PlayerTask(models.Model):
+class PlayerTask(TrackedFieldsModel):
     STATUS_CHOICES = [
         ("AV", "Available"),
         ("CM", "Completed"),
@@ -81,7 +168,7 @@ class PlayerTask(models.Model):
     class Meta:
         unique_together = ("player", "task")
     
-class Meme(models.Model):
+class Meme(TrackedFieldsModel):
     name = models.CharField(max_length=255, null=False)
     # data = models.JSONField()
     coins_per_hour = models.IntegerField(null=False)
@@ -89,7 +176,7 @@ class Meme(models.Model):
     logo = models.CharField(max_length=1023)
 
 
-class MemePlayer(models.Model):
+class MemePlayer(TrackedFieldsModel):
     player = models.ForeignKey(Player, on_delete=models.CASCADE)
     meme = models.ForeignKey(Meme, on_delete=models.CASCADE)
     purchase_time = models.DateTimeField(auto_now_add=True)
@@ -98,4 +185,64 @@ class MemePlayer(models.Model):
     current_upgrade_cost = models.IntegerField(default=1)
 
     class Meta:
-        unique_together = ("player", "meme")
\ No newline at end of file
+        unique_together = ("player", "meme")
+
+
+class OutboundMessage(models.Model):
+    STATUS_CHOICES = [
+        ("PE", "Pending"),
+        ("SE", "Sent"),
+        ("FA", "Failed"),
+    ]
+
+    chat_id = models.BigIntegerField()
+    text = models.TextField()
+    status = models.CharField(max_length=2, choices=STATUS_CHOICES, default="PE")
+    attempts = models.IntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.CharField(max_length=1023, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["status", "next_attempt_at"], name="outbound_due_idx")]
+
+
+class ReferralEarning(models.Model):
+    """
+    Coins earned by a referred player, waiting to be paid out as commissions
+    up the referred_by chain (see ReferralProcessor). Rows are only inserted
+    on the hot path and deleted once paid.
+    """
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    coins = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+class CoinLedger(models.Model):
+    """
+    Coin credits appended without touching the player row, folded into
+    Player.coins_balance in bulk by LedgerProcessor. A player's balance is
+    coins_balance plus the sum of their rows still in this table.
+    """
+    REASON_CHOICES = [
+        ("TA", "Task reward"),
+        ("UP", "Upgrade"),
+        ("ME", "Meme"),
+        ("RE", "Referral commission"),
+        ("PI", "Passive income"),
+    ]
+
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    delta = models.BigIntegerField()
+    reason = models.CharField(max_length=2, choices=REASON_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+
+
+class CoinLedgerArchive(models.Model):
+    """Coin changes already applied to Player.coins_balance, kept as history."""
+    player = models.ForeignKey(Player, on_delete=models.CASCADE)
+    delta = models.BigIntegerField()
+    reason = models.CharField(max_length=2, choices=CoinLedger.REASON_CHOICES)
+    created_at = models.DateTimeField(default=timezone.now)
+    applied_at = models.DateTimeField(default=timezone.now)
@@ -0,0 +1,213 @@
+"""
+Read-through cache of player rows keyed by telegram id, for the endpoints
+that only read the player. Two tiers: a process-local LRU bounded by
+PLAYER_CACHE_SIZE entries with a short TTL, in front of an optional shared
+cache alias (PLAYER_CACHE_SHARED, e.g. the Redis "shared" alias; any Django
+cache backend works, LocMemCache stands in for Redis in development).
+
+Writers invalidate the rows they touched, right away and again once their
+transaction commits: Player saves through a signal, queryset updates of
+player rows by calling invalidate() with the ids. Only the local tier of the
+process that wrote is invalidated, so the local TTL bounds how stale another
+worker's copy can be. Jobs that update players by the range or by the
+million bump a generation instead, which is part of every shared key and is
+re-read by each process once per local TTL.
+
+Cached players are snapshots for reading; don't save them.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .metrics import registry
+from .models import Player
+
+
+class PlayerStateCache:
+    def __init__(self):
+        self.fields = [field.attname for field in Player._meta.concrete_fields]
+        # Rows cached before a schema change don't match the new field list
+        schema = hashlib.md5(",".join(self.fields).encode()).hexdigest()[:8]
+        self.key_prefix = f"player_state:{schema}:"
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every invalidation, a miss started before one doesn't
+        # store the row it read.
+        self._generation = 0
+        # Shared generation as last read, and when to read it again
+        self._shared_generation = (0, 0.0)
+        self.requests = defaultdict(int)
+        self.evictions = defaultdict(int)
+        self.invalidations = 0
+
+    def _shared(self):
+        return caches[settings.PLAYER_CACHE_SHARED] if settings.PLAYER_CACHE_SHARED else None
+
+    def _shared_key(self, shared, telegram_id) -> str:
+        generation, expires_at = self._shared_generation
+        if expires_at < time.monotonic():
+            key = self.key_prefix + "generation"
+            shared.add(key, 0, None)
+            generation = shared.get(key, 0)
+            self._shared_generation = (generation, time.monotonic() + settings.PLAYER_CACHE_LOCAL_TTL)
+        return f"{self.key_prefix}{generation}:{telegram_id}"
+
+    def _local_get(self, telegram_id: int):
+        if not settings.PLAYER_CACHE_SIZE:
+            return None
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None:
+                return None
+            expires_at, values = entry
+            if expires_at < time.monotonic():
+                del self._entries[telegram_id]
+                self.evictions["expired"] += 1
+                return None
+            self._entries.move_to_end(telegram_id)
+            return values
+
+    def _local_set(self, telegram_id: int, values, generation=None):
+        if not settings.PLAYER_CACHE_SIZE:
+            return
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[telegram_id] = (time.monotonic() + settings.PLAYER_CACHE_LOCAL_TTL, values)
+            self._entries.move_to_end(telegram_id)
+            while len(self._entries) > settings.PLAYER_CACHE_SIZE:
+                self._entries.popitem(last=False)
+                self.evictions["size"] += 1
+
+    def _values(self, telegram_id: int):
+        values = self._local_get(telegram_id)
+        if values is not None:
+            self.requests["local_hit"] += 1
+            return values
+
+        shared = self._shared()
+        if shared is not None:
+            values = shared.get(self._shared_key(shared, telegram_id))
+            if values is not None:
+                self.requests["shared_hit"] += 1
+                self._local_set(telegram_id, values)
+                return values
+
+        self.requests["miss"] += 1
+        generation = self._generation
+        values = Player.objects.filter(pk=telegram_id).values_list(*self.fields).first()
+        if values is None:
+            return None
+        if shared is not None:
+            shared.set(self._shared_key(shared, telegram_id), values, settings.PLAYER_CACHE_TTL)
+        self._local_set(telegram_id, values, generation)
+        return values
+
+    def get(self, telegram_id) -> Player:
+        """The player row, raises Player.DoesNotExist like Player.objects.get."""
+        try:
+            telegram_id = int(telegram_id)
+        except (TypeError, ValueError):
+            raise Player.DoesNotExist
+        values = self._values(telegram_id)
+        if values is None:
+            raise Player.DoesNotExist
+        return Player.from_db(DEFAULT_DB_ALIAS, self.fields, values)
+
+    async def aget(self, telegram_id) -> Player:
+        try:
+            values = self._local_get(int(telegram_id))
+        except (TypeError, ValueError):
+            raise Player.DoesNotExist
+        if values is None:
+            return await sync_to_async(self.get)(telegram_id)
+        self.requests["local_hit"] += 1
+        return Player.from_db(DEFAULT_DB_ALIAS, self.fields, values)
+
+    def invalidate(self, telegram_ids):
+        telegram_ids = [int(telegram_id) for telegram_id in telegram_ids]
+        if not telegram_ids:
+            return
+        self._drop(telegram_ids)
+        if transaction.get_connection().in_atomic_block:
+            # A miss that read the row before the commit may have cached it again
+            transaction.on_commit(lambda: self._drop(telegram_ids))
+
+    def _drop(self, telegram_ids):
+        with self._lock:
+            self._generation += 1
+            for telegram_id in telegram_ids:
+                self._entries.pop(telegram_id, None)
+        self.invalidations += len(telegram_ids)
+        shared = self._shared()
+        if shared is not None:
+            shared.delete_many([self._shared_key(shared, telegram_id) for telegram_id in telegram_ids])
+
+    def bump_generation(self):
+        """
+        Invalidates every cached player at once, for writes too broad to list
+        their ids. Other processes drop their local copies within the local TTL.
+        """
+        self.clear()
+        shared = self._shared()
+        if shared is not None:
+            key = self.key_prefix + "generation"
+            shared.add(key, 0, None)
+            generation = shared.incr(key)
+            self._shared_generation = (generation, time.monotonic() + settings.PLAYER_CACHE_LOCAL_TTL)
+        self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        hits = self.requests["local_hit"] + self.requests["shared_hit"]
+        total = hits + self.requests["miss"]
+        return {
+            "entries": len(self._entries),
+            "local_hits": self.requests["local_hit"],
+            "shared_hits": self.requests["shared_hit"],
+            "misses": self.requests["miss"],
+            "hit_ratio": round(hits / total, 4) if total else 0.0,
+            "evictions": dict(self.evictions),
+            "invalidations": self.invalidations,
+        }
+
+    def render_metrics(self) -> list:
+        stats = self.stats()
+        lines = [
+            "# HELP coin_player_cache_requests_total Player cache lookups, by result.",
+            "# TYPE coin_player_cache_requests_total counter",
+        ]
+        for result in ("local_hit", "shared_hit", "miss"):
+            lines.append(f'coin_player_cache_requests_total{{result="{result}"}} {self.requests[result]}')
+        lines += [
+            "# HELP coin_player_cache_hit_ratio Share of player cache lookups served from a cache tier.",
+            "# TYPE coin_player_cache_hit_ratio gauge",
+            f"coin_player_cache_hit_ratio {stats['hit_ratio']}",
+            "# HELP coin_player_cache_evictions_total Local tier entries evicted, by reason.",
+            "# TYPE coin_player_cache_evictions_total counter",
+        ]
+        for reason in ("size", "expired"):
+            lines.append(f'coin_player_cache_evictions_total{{reason="{reason}"}} {self.evictions[reason]}')
+        lines += [
+            "# HELP coin_player_cache_invalidations_total Player rows invalidated by writes.",
+            "# TYPE coin_player_cache_invalidations_total counter",
+            f"coin_player_cache_invalidations_total {self.invalidations}",
+            "# HELP coin_player_cache_entries Rows held by the local tier.",
+            "# TYPE coin_player_cache_entries gauge",
+            f"coin_player_cache_entries {stats['entries']}",
+        ]
+        return lines
+
+
+player_state_cache = PlayerStateCache()
+registry.add_collector(player_state_cache.render_metrics)
@@ -0,0 +1,874 @@
+from collections import defaultdict
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Collate, Least, Upper
+from .models import (
+    CoinLedger,
+    CoinLedgerArchive,
+    LeagueRank,
+    Meme,
+    MemePlayer,
+    Player,
+    ReferralEarning,
+    Team,
+)
+from django.db import connection, transaction
+from django.utils import timezone
+from .catalog import league_ladder, meme_catalog
+from .db import insert_from, pk_chunks, update_returning
+from .player_cache import player_state_cache
+from datetime import datetime
+import pytz
+import time
+from typing import Callable
+
+HOUR = 3600
+ENERGY_MULTIPLIER = 1000
+FULL_ENERGY: Callable[[Player], int] = lambda player: player.energy_limit_level*ENERGY_MULTIPLIER
+MAX_BOOSTS_COUNT = 3
+BOOST_COUNTERS = {"rocket": "rocket_count", "full_energy": "full_energy_count"}
+DAY = 86400
+GAME_TIMEZONE = 'Etc/GMT-2'
+# The game timezone has a fixed offset, so day boundaries are plain integer
+# arithmetic on unix timestamps.
+GAME_UTC_OFFSET = int(pytz.timezone(GAME_TIMEZONE).utcoffset(datetime(2000, 1, 1)).total_seconds())
+
+
+def day_key(timestamp: int) -> int:
+    """Number of the game day (in GAME_TIMEZONE) the timestamp falls into."""
+    return (int(timestamp) + GAME_UTC_OFFSET) // DAY
+
+
+def week_key(day: int) -> int:
+    # Day 0 (1970-01-01) was a Thursday, shift so that weeks start on Monday.
+    return (day + 3) // 7
+
+
+class PlayerProcessor:
+    # Tap syncs racing a fold or a purchase read the player again this many times
+    SYNC_ATTEMPTS = 3
+
+    @classmethod 
+    def next_League_check(cls, player: Player) -> Player:
+        current_league = LeagueProcessor.get_league(player.league_id)
+        if current_league is None:
+            return player
+        league = LeagueProcessor.resolve_league(player.total_coins_earned)
+        if league and league.level > current_league.level:
+            player.league = league
+        return player
+
+    @classmethod
+    def update_coins(cls, player: Player, new_coins_count, pending_coins: int = 0) -> Player:
+        """
+        Store the balance a client reports. The client's balance includes the
+        ledger credits it was shown (pending_coins, not folded yet), so those
+        stay out of coins_balance and out of the coins earned by tapping.
+        """
+        balance = player.coins_balance + pending_coins
+        if new_coins_count > balance:
+            cls.credit_earned(player, new_coins_count - balance)
+        player.coins_balance = new_coins_count - pending_coins
+        cls.next_League_check(player)
+        return player
+
+    @classmethod
+    def sync_taps(cls, telegram_id, new_coins_count, energy_count: int, last_seen: int) -> bool:
+        """
+        Store a client's tap sync without locking the player. The balance it
+        reports becomes a delta against the row as read, applied by a single
+        UPDATE that only matches while coins_balance and total_coins_earned
+        are still what was read; a fold or a purchase in between makes it
+        read again. Unfolded credits stay in the ledger for the folder.
+        False if the player kept changing for SYNC_ATTEMPTS reads.
+        """
+        for _ in range(cls.SYNC_ATTEMPTS):
+            player = Player.objects.annotate(pending_coins=LedgerProcessor.pending_coins()).get(
+                telegram_id=telegram_id
+            )
+            balance, total = player.coins_balance, player.total_coins_earned
+            cls.update_coins(player, new_coins_count, player.pending_coins)
+            player.energy_balance = energy_count
+            player.last_seen = last_seen
+            changes = {field: getattr(player, field) for field in player.get_dirty_fields()}
+            changes["coins_balance"] = F("coins_balance") + (player.coins_balance - balance)
+            changes["total_coins_earned"] = F("total_coins_earned") + (player.total_coins_earned - total)
+            with transaction.atomic():
+                row = update_returning(
+                    Player.objects.filter(telegram_id=telegram_id, coins_balance=balance, total_coins_earned=total),
+                    ["team_id", "referred_by_id"],
+                    **changes,
+                )
+                if row is None:
+                    continue
+                # The team may have changed since the read, credit the current one
+                player.team_id, player.referred_by_id = row["team_id"], row["referred_by_id"]
+                player_state_cache.invalidate([telegram_id])
+                EarningsProcessor.commit([player])
+            return True
+        return False
+
+    @classmethod
+    def promote(cls, player_ids):
+        """League checks of players whose total_coins_earned a queryset update raised."""
+        promotions = defaultdict(list)
+        for player in Player.objects.filter(pk__in=player_ids).only("league", "total_coins_earned"):
+            league_id = player.league_id
+            cls.next_League_check(player)
+            if player.league_id != league_id:
+                promotions[player.league_id].append(player.pk)
+        for league_id, promoted_ids in promotions.items():
+            Player.objects.filter(pk__in=promoted_ids).update(league_id=league_id)
+
+    @classmethod
+    def add_coins(cls, player: Player, coins_to_add: int) -> Player:
+        player.coins_balance += coins_to_add
+        cls.credit_earned(player, coins_to_add)
+        cls.next_League_check(player)
+        return player
+
+    @classmethod
+    def credit_earned(cls, player: Player, earned: int) -> Player:
+        player.total_coins_earned += earned
+        if earned > 0:
+            cls.credit_period_earnings(player, earned)
+            # Picked up by EarningsProcessor.commit once the row is saved
+            player._coins_earned = getattr(player, "_coins_earned", 0) + earned
+        return player
+
+    @classmethod
+    def credit_period_earnings(cls, player: Player, earned: int, timestamp=None) -> Player:
+        # Day/week counters restart lazily: a counter whose key is not the
+        # current period holds stale coins and is reset on the next credit.
+        today = day_key(timestamp if timestamp is not None else time.time())
+        if player.earned_day_key != today:
+            player.earned_day_key = today
+            player.total_earned_day = 0
+        if player.earned_week_key != week_key(today):
+            player.earned_week_key = week_key(today)
+            player.total_earned_week = 0
+        player.total_earned_day += earned
+        player.total_earned_week += earned
+        return player
+    
+    @classmethod
+    def calculate_passive_income(cls, player: Player, passive_income_per_hour):
+        current_time = int(time.time())
+        total_seconds_offline = current_time - player.last_seen
+        capped_seconds_offline = min(total_seconds_offline, 10800)
+        passive_income = (capped_seconds_offline / HOUR) * passive_income_per_hour
+
+        return int(passive_income)
+
+    @classmethod
+    def current_energy(cls, player: Player, current_time=None) -> int:
+        # energy_balance is the balance at last_seen, energy regenerates from
+        # there up to the limit. Reading it never needs a write.
+        if current_time is None:
+            current_time = int(time.time())
+        total_seconds_offline = current_time - player.last_seen
+        energy_balance = player.energy_balance + int(player.recharging_speed_level * total_seconds_offline)
+        return min(energy_balance, FULL_ENERGY(player))
+
+    @classmethod
+    def update_in_chunks(cls, players, chunk_size: int, sleep: float = 0):
+        """
+        pk_chunks of a Player queryset for range jobs; the player cache
+        generation is bumped after each chunk has been updated.
+        """
+        for chunk in pk_chunks(players, chunk_size, sleep):
+            yield chunk
+            player_state_cache.bump_generation()
+
+    @classmethod
+    def energy_rebase(cls, current_time=None) -> dict:
+        """
+        UPDATE values moving the energy anchor to now, with the energy
+        regenerated so far at the current levels. Statements that change the
+        limit or speed include them, so the new levels only count from now on.
+        last_seen is the passive income anchor as well, see
+        settle_passive_income.
+        """
+        if current_time is None:
+            current_time = int(time.time())
+        return {
+            "energy_balance": Least(
+                F("energy_balance") + F("recharging_speed_level") * (Value(current_time) - F("last_seen")),
+                F("energy_limit_level") * ENERGY_MULTIPLIER,
+            ),
+            "last_seen": Value(current_time),
+        }
+
+    @classmethod
+    def settle_passive_income(cls, players, current_time: int) -> int:
+        """
+        Credit the passive income a Player queryset earned since last_seen,
+        at the current coins per hour, to the ledger with a single INSERT
+        that locks the rows. Statements changing total_coins_per_hour run it
+        first in their transaction and include energy_rebase(current_time),
+        so the new rate only counts from now on. Returns how many players
+        were credited.
+        """
+        income = F("total_coins_per_hour") * (Value(current_time) - F("last_seen")) / Value(HOUR)
+        return insert_from(
+            players.select_for_update()
+            .annotate(passive_income=income)
+            .filter(passive_income__gt=0)
+            .order_by("pk"),
+            CoinLedger,
+            player_id=F("pk"),
+            delta=F("passive_income"),
+            reason=Value("PI"),
+            created_at=Value(timezone.now()),
+        )
+
+    @classmethod
+    def calculate_energy(cls, player: Player):
+        player.energy_balance = cls.current_energy(player)
+        return player
+
+    @classmethod
+    def use_boost(cls, telegram_id, boost_type: str):
+        """
+        Spends one boost in a single conditional UPDATE, so concurrent taps
+        can't spend the same boost twice. Boosts not refilled yet today are
+        refilled by the same statement, as update_boosts would. Returns the
+        remaining count, or None when the player had none left (or doesn't
+        exist).
+        """
+        today = day_key(time.time())
+        stale = Q(boosts_reset_day__lt=today)
+        changes = {
+            field: Case(When(stale, then=Value(MAX_BOOSTS_COUNT)), default=F(field))
+            for field in BOOST_COUNTERS.values()
+        }
+        counter = BOOST_COUNTERS[boost_type]
+        changes[counter] = Case(When(stale, then=Value(MAX_BOOSTS_COUNT - 1)), default=F(counter) - 1)
+        changes["boosts_reset_day"] = Value(today)
+        if boost_type == "full_energy":
+            changes["energy_balance"] = F("energy_limit_level") * ENERGY_MULTIPLIER
+            # Full energy as of now, regeneration restarts from here
+            changes["last_seen"] = Value(int(time.time()))
+        row = update_returning(
+            Player.objects.filter(Q(**{f"{counter}__gt": 0}) | stale, telegram_id=telegram_id), [counter], **changes
+        )
+        if row is None:
+            return None
+        player_state_cache.invalidate([telegram_id])
+        return row[counter]
+
+    @classmethod
+    def update_boosts(cls, player: Player, today: int = None):
+        """Refills daily boosts if they weren't refilled yet today."""
+        if today is None:
+            today = day_key(time.time())
+        if player.boosts_reset_day < today:
+            player.rocket_count = MAX_BOOSTS_COUNT
+            player.full_energy_count = MAX_BOOSTS_COUNT
+            player.boosts_reset_day = today
+        return player
+    
+    @classmethod
+    def calculate_passive_income(cls, player: Player):
+        current_time = int(time.time())
+        total_seconds_offline = current_time - player.last_seen
+        passive_income = (total_seconds_offline / 3600) * player.total_coins_per_hour
+        return int(passive_income)
+    
+class LeagueProcessor:
+    @classmethod
+    def get_league(cls, league_id):
+        if league_id is None:
+            return None
+        return league_ladder.get_league(league_id)
+
+    @classmethod
+    def resolve_league(cls, total_coins_earned: int):
+        return league_ladder.resolve(total_coins_earned)
+
+    @classmethod
+    def get_next_league(cls, current_level: int):
+        return league_ladder.get_by_level(current_level+1)
+
+
+class TeamProcessor:
+    LEADERBOARD_CACHE_KEY = "team_leaderboard"
+
+    @classmethod
+    def add_coins(cls, team_deltas: dict):
+        team_deltas = {team_id: delta for team_id, delta in team_deltas.items() if delta}
+        if not team_deltas:
+            return
+        if len(team_deltas) == 1:
+            [(team_id, delta)] = team_deltas.items()
+            increment = Value(delta)
+        else:
+            increment = Case(
+                *[When(pk=team_id, then=Value(delta)) for team_id, delta in team_deltas.items()],
+                default=Value(0),
+            )
+        Team.objects.filter(pk__in=team_deltas.keys()).update(coins_count=F("coins_count") + increment)
+
+    @classmethod
+    def move_player(cls, player: Player, team):
+        """
+        Move player to team (or out of any team) together with their coins.
+        The player has to be locked with select_for_update in the caller's
+        transaction, its team_id and total_coins_earned are what gets moved.
+        """
+        old_team_id = player.team_id
+        player.team = team
+        new_team_id = player.team_id
+        if old_team_id == new_team_id:
+            return player
+        deltas = defaultdict(int)
+        if old_team_id is not None:
+            deltas[old_team_id] -= player.total_coins_earned
+        if new_team_id is not None:
+            deltas[new_team_id] += player.total_coins_earned
+        cls.add_coins(deltas)
+        return player
+
+    @classmethod
+    def members_total(cls):
+        return Coalesce(
+            Subquery(
+                Player.objects.filter(team=OuterRef("pk"))
+                .order_by()
+                .values("team")
+                .annotate(total=Sum("total_coins_earned"))
+                .values("total")
+            ),
+            Value(0),
+        )
+
+    @classmethod
+    def leaderboard_cache(cls):
+        # Shared with the catalogs, so a snapshot rebuilt by the
+        # refresh_team_leaderboard command reaches every worker
+        return caches[settings.CATALOG_CACHE]
+
+    @classmethod
+    def refresh_leaderboard(cls):
+        teams = list(
+            Team.objects.order_by("-coins_count", "id").values("id", "name")[
+                : settings.TEAM_LEADERBOARD_SIZE
+            ]
+        )
+        cls.leaderboard_cache().set(cls.LEADERBOARD_CACHE_KEY, teams, settings.TEAM_LEADERBOARD_TTL)
+        return teams
+
+    @classmethod
+    def get_top_teams(cls, limit: int):
+        teams = cls.leaderboard_cache().get(cls.LEADERBOARD_CACHE_KEY)
+        if teams is None:
+            teams = cls.refresh_leaderboard()
+        return teams[:limit]
+
+    @classmethod
+    def search(cls, query: str, limit: int, cursor=None):
+        """
+        Teams whose name starts with query, ignoring case, ordered by name so
+        the closest matches come first. Served by team_name_search_idx; cursor
+        is the (id, search name) pair of the last row of the previous page.
+        """
+        search_name = Upper("name")
+        if connection.vendor == "postgresql":
+            # Matches the index expression created by migration 0008
+            search_name = Collate(search_name, "C")
+        teams = (
+            Team.objects.annotate(search_name=search_name)
+            # Upper-cased by the database, the same way as the indexed names
+            .filter(search_name__startswith=Upper(Value(query)))
+            .order_by("search_name", "id")
+        )
+        if cursor is not None:
+            team_id, search_name = cursor
+            # The separate >= bound is what lets the index scan start at the cursor
+            teams = teams.filter(search_name__gte=search_name).filter(
+                Q(search_name__gt=search_name) | Q(id__gt=team_id)
+            )
+        rows = list(teams.values("id", "name", "search_name")[:limit])
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = f"{rows[-1]['id']}:{rows[-1]['search_name']}"
+        return [{"id": row["id"], "name": row["name"]} for row in rows], next_cursor
+
+
+class MemeProcessor:
+    @classmethod
+    def owned_income(cls):
+        """Expression: total coins per hour of a player's memes, for Player updates."""
+        return Coalesce(
+            Subquery(
+                MemePlayer.objects.filter(player=OuterRef("pk"))
+                .order_by()
+                .values("player")
+                .annotate(total=Sum("current_coins_per_hour"))
+                .values("total")
+            ),
+            Value(0),
+        )
+
+    @classmethod
+    def reprice(cls, meme: Meme) -> int:
+        """
+        Moves every MemePlayer row of a meme onto the meme's current level
+        curve with one UPDATE, then recomputes its owners' coins per hour with
+        another, without listing the owners. Returns how many rows were
+        repriced.
+        """
+        curve = meme_catalog.curve(meme)
+        owned = MemePlayer.objects.filter(meme_id=meme.id)
+        levels = list(owned.order_by().values_list("current_level", flat=True).distinct())
+        if not levels:
+            return 0
+        per_level = lambda value, current: Case(
+            *[When(current_level=level, then=Value(value(level))) for level in levels],
+            default=F(current),
+        )
+        with transaction.atomic():
+            repriced = owned.update(
+                current_coins_per_hour=per_level(curve.income, "current_coins_per_hour"),
+                current_upgrade_cost=per_level(curve.cost, "current_upgrade_cost"),
+            )
+            if repriced:
+                owners = Player.objects.filter(pk__in=Subquery(owned.values("player_id")))
+                # Income so far was earned at the old rates
+                current_time = int(time.time())
+                PlayerProcessor.settle_passive_income(owners, current_time)
+                owners.update(
+                    total_coins_per_hour=cls.owned_income(),
+                    **PlayerProcessor.energy_rebase(current_time),
+                )
+        if repriced:
+            # Too many owners to invalidate one by one
+            player_state_cache.bump_generation()
+        return repriced
+
+
+class EarningsProcessor:
+    @classmethod
+    def commit(cls, players):
+        """
+        Propagate coins earned by already saved players to their teams, and
+        record them for referral commissions.
+        """
+        team_deltas = defaultdict(int)
+        referral_earnings = []
+        for player in players:
+            earned = player.__dict__.pop("_coins_earned", 0)
+            if earned and player.team_id is not None:
+                team_deltas[player.team_id] += earned
+            if earned > 0 and player.__dict__.get("referred_by_id") is not None:
+                referral_earnings.append(ReferralEarning(player_id=player.pk, coins=earned))
+        TeamProcessor.add_coins(team_deltas)
+        if referral_earnings and settings.REFERRAL_COMMISSION_RATES:
+            ReferralEarning.objects.bulk_create(referral_earnings)
+
+
+class FriendsProcessor:
+    @classmethod
+    def friendships(cls):
+        return Player.friends.through.objects
+
+    @classmethod
+    def added(cls, player_id, friend_ids):
+        """Count friendships just added from player_id's side, mirrors included."""
+        if not friend_ids:
+            return
+        Player.objects.filter(pk__in=[player_id, *friend_ids]).update(
+            friends_count=F("friends_count")
+            + Case(When(pk=player_id, then=Value(len(friend_ids))), default=Value(1))
+        )
+        player_state_cache.invalidate([player_id, *friend_ids])
+
+    @classmethod
+    def removing(cls, player_id, friend_ids=None):
+        """
+        Uncount friendships of player_id about to be deleted, all of them when
+        friend_ids is None. Runs before the delete so only existing rows count.
+        """
+        friendships = cls.friendships().filter(from_player_id=player_id).exclude(to_player_id=player_id)
+        if friend_ids is not None:
+            friendships = friendships.filter(to_player_id__in=friend_ids)
+        # Listed first so the cached rows of the friends can be invalidated
+        friend_ids = list(friendships.values_list("to_player_id", flat=True))
+        if not friend_ids:
+            return
+        Player.objects.filter(pk__in=friend_ids).update(friends_count=F("friends_count") - 1)
+        Player.objects.filter(pk=player_id).update(friends_count=F("friends_count") - len(friend_ids))
+        player_state_cache.invalidate([player_id, *friend_ids])
+
+    @classmethod
+    def recount(cls, players):
+        """Recompute the stored counters of a Player queryset from scratch."""
+        players.update(
+            friends_count=Coalesce(
+                Subquery(
+                    cls.friendships()
+                    .filter(from_player_id=OuterRef("pk"))
+                    .exclude(to_player_id=OuterRef("pk"))
+                    .order_by()
+                    .values("from_player_id")
+                    .annotate(count=Count("*"))
+                    .values("count")
+                ),
+                Value(0),
+            ),
+            referrals_count=Coalesce(
+                Subquery(
+                    Player.objects.filter(referred_by=OuterRef("pk"))
+                    .order_by()
+                    .values("referred_by")
+                    .annotate(count=Count("*"))
+                    .values("count")
+                ),
+                Value(0),
+            ),
+        )
+        player_state_cache.invalidate(players.values_list("pk", flat=True))
+
+    @classmethod
+    def move_referral(cls, old_referrer_id, new_referrer_id):
+        if old_referrer_id == new_referrer_id:
+            return
+        if old_referrer_id is not None:
+            Player.objects.filter(pk=old_referrer_id).update(referrals_count=F("referrals_count") - 1)
+        if new_referrer_id is not None:
+            Player.objects.filter(pk=new_referrer_id).update(referrals_count=F("referrals_count") + 1)
+        player_state_cache.invalidate(
+            [referrer_id for referrer_id in (old_referrer_id, new_referrer_id) if referrer_id is not None]
+        )
+
+    @classmethod
+    def get_page(cls, player_id, limit: int, cursor=None):
+        """
+        One page of a player's friends ordered by telegram id, with their
+        league and coins, in one query over the (from_player, to_player)
+        unique index. cursor is the telegram id of the last friend returned.
+        """
+        friendships = (
+            cls.friendships()
+            .filter(from_player_id=player_id)
+            .exclude(to_player_id=player_id)
+            .order_by("to_player_id")
+        )
+        if cursor is not None:
+            friendships = friendships.filter(to_player_id__gt=cursor)
+        rows = list(
+            friendships.values_list(
+                "to_player_id", "to_player__name", "to_player__league_id", "to_player__coins_balance"
+            )[:limit]
+        )
+        friends = []
+        for telegram_id, name, league_id, coins_balance in rows:
+            league = league_ladder.get_league(league_id)
+            friends.append({
+                "name": name,
+                "telegram_id": telegram_id,
+                "league": league.name if league else None,
+                "coins_count": coins_balance,
+            })
+        next_cursor = rows[-1][0] if len(rows) == limit else None
+        return friends, next_cursor
+
+
+class LedgerProcessor:
+    @classmethod
+    def credit(cls, player_id, delta: int, reason: str) -> CoinLedger:
+        """Append a credit; it counts in the balance right away and is folded later."""
+        return CoinLedger.objects.create(player_id=player_id, delta=delta, reason=reason)
+
+    @classmethod
+    def credit_many(cls, deltas: dict, reason: str):
+        """Append one credit per player of deltas with a single INSERT."""
+        CoinLedger.objects.bulk_create(
+            CoinLedger(player_id=player_id, delta=delta, reason=reason) for player_id, delta in deltas.items()
+        )
+
+    @classmethod
+    def record_applied(cls, player_id, delta: int, reason: str):
+        """History of a change already applied to coins_balance, e.g. a debit."""
+        CoinLedgerArchive.objects.create(player_id=player_id, delta=delta, reason=reason)
+
+    @classmethod
+    def pending_coins(cls):
+        """Annotation: sum of a player's credits not folded yet."""
+        return Coalesce(
+            Subquery(
+                CoinLedger.objects.filter(player_id=OuterRef("pk"))
+                .order_by()
+                .values("player_id")
+                .annotate(total=Sum("delta"))
+                .values("total")
+            ),
+            Value(0),
+        )
+
+    @classmethod
+    def pending_for(cls, player_ids) -> dict:
+        """
+        Unfolded credits per player. Callers that overwrite coins_balance read
+        this after locking the player rows: folding needs those locks, so the
+        tail can't be folded under them.
+        """
+        return dict(
+            CoinLedger.objects.filter(player_id__in=player_ids)
+            .order_by()
+            .values("player_id")
+            .annotate(total=Sum("delta"))
+            .values_list("player_id", "total")
+        )
+
+    @classmethod
+    def fold(cls, batch_size: int = 5000) -> int:
+        """Fold one batch of the oldest ledger rows, returns how many were folded."""
+        with transaction.atomic():
+            entries = list(
+                CoinLedger.objects.select_for_update(skip_locked=True)
+                .order_by("id")
+                .values_list("id", "player_id", "delta", "reason", "created_at")[:batch_size]
+            )
+            cls._apply(entries)
+        return len(entries)
+
+    @classmethod
+    def fold_player(cls, player_id) -> int:
+        """Fold one player's tail now, e.g. before spending it."""
+        with transaction.atomic():
+            entries = list(
+                CoinLedger.objects.select_for_update()
+                .filter(player_id=player_id)
+                .order_by("id")
+                .values_list("id", "player_id", "delta", "reason", "created_at")
+            )
+            cls._apply(entries)
+        return len(entries)
+
+    @classmethod
+    def _apply(cls, entries):
+        if not entries:
+            return
+        deltas = defaultdict(int)
+        earned = defaultdict(int)
+        # Commissions are already paid up the whole chain by ReferralProcessor
+        commissionable = defaultdict(int)
+        for _, player_id, delta, reason, _ in entries:
+            deltas[player_id] += delta
+            if delta > 0:
+                earned[player_id] += delta
+                if reason != "RE":
+                    commissionable[player_id] += delta
+
+        # Same lock order as the write-behind flush
+        players = {
+            pk: (team_id, referred_by_id)
+            for pk, team_id, referred_by_id in Player.objects.select_for_update()
+            .filter(pk__in=deltas)
+            .order_by("pk")
+            .values_list("pk", "team_id", "referred_by_id")
+        }
+        per_player = lambda values: Case(
+            *[When(pk=pk, then=Value(value)) for pk, value in values.items() if value],
+            default=Value(0),
+        )
+        today = day_key(time.time())
+        this_week = week_key(today)
+        # Period counters restart the same way credit_period_earnings does
+        Player.objects.filter(pk__in=players).update(
+            coins_balance=F("coins_balance") + per_player(deltas),
+            total_coins_earned=F("total_coins_earned") + per_player(earned),
+            total_earned_day=Case(
+                When(earned_day_key=today, then=F("total_earned_day") + per_player(earned)),
+                default=per_player(earned),
+            ),
+            earned_day_key=Value(today),
+            total_earned_week=Case(
+                When(earned_week_key=this_week, then=F("total_earned_week") + per_player(earned)),
+                default=per_player(earned),
+            ),
+            earned_week_key=Value(this_week),
+        )
+        PlayerProcessor.promote([pk for pk in players if earned[pk]])
+        player_state_cache.invalidate(players)
+
+        team_deltas = defaultdict(int)
+        referral_earnings = []
+        for pk, (team_id, referred_by_id) in players.items():
+            if not earned[pk]:
+                continue
+            if team_id is not None:
+                team_deltas[team_id] += earned[pk]
+            if referred_by_id is not None and commissionable[pk]:
+                referral_earnings.append(ReferralEarning(player_id=pk, coins=commissionable[pk]))
+        TeamProcessor.add_coins(team_deltas)
+        if referral_earnings and settings.REFERRAL_COMMISSION_RATES:
+            ReferralEarning.objects.bulk_create(referral_earnings)
+
+        now = timezone.now()
+        CoinLedgerArchive.objects.bulk_create(
+            CoinLedgerArchive(
+                player_id=player_id, delta=delta, reason=reason, created_at=created_at, applied_at=now
+            )
+            for _, player_id, delta, reason, created_at in entries
+            if player_id in players
+        )
+        CoinLedger.objects.filter(id__in=[entry[0] for entry in entries]).delete()
+
+
+class ReferralProcessor:
+    # Referrers of the given players up the referred_by chain, as (player,
+    # referrer, level) rows. A chain ends where it loops back to the player,
+    # the level bound stops any other cycle.
+    CHAIN_SQL = """
+        WITH RECURSIVE chain (player_id, referrer_id, level) AS (
+            SELECT telegram_id, referred_by_id, 1 FROM {table}
+            WHERE telegram_id IN ({player_ids}) AND referred_by_id IS NOT NULL
+            UNION ALL
+            SELECT chain.player_id, referrer.referred_by_id, chain.level + 1
+            FROM chain JOIN {table} referrer ON referrer.telegram_id = chain.referrer_id
+            WHERE chain.level < %s AND referrer.referred_by_id IS NOT NULL
+            AND referrer.referred_by_id <> chain.player_id
+        )
+        SELECT player_id, referrer_id, level FROM chain WHERE referrer_id <> player_id
+    """
+
+    @classmethod
+    def referrers(cls, player_ids, levels: int):
+        player_ids = list(player_ids)
+        sql = cls.CHAIN_SQL.format(
+            table=connection.ops.quote_name(Player._meta.db_table),
+            player_ids=", ".join(["%s"] * len(player_ids)),
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*player_ids, levels])
+            return cursor.fetchall()
+
+    @classmethod
+    def pay_batch(cls, batch_size: int = 1000) -> int:
+        """
+        Credit the commissions of one batch of recorded earnings to the
+        ledger, one row per referrer. Like any other credit they show up in
+        the referrer's balance right away and are folded (team, period
+        counters, league) later. Returns how many earnings were processed.
+        """
+        rates = settings.REFERRAL_COMMISSION_RATES
+        with transaction.atomic():
+            earnings = list(
+                ReferralEarning.objects.select_for_update(skip_locked=True)
+                .order_by("id")
+                .values_list("id", "player_id", "coins")[:batch_size]
+            )
+            if not earnings:
+                return 0
+            earned = defaultdict(int)
+            for _, player_id, coins in earnings:
+                earned[player_id] += coins
+
+            commissions = defaultdict(float)
+            for player_id, referrer_id, level in cls.referrers(earned, len(rates)):
+                commissions[referrer_id] += earned[player_id] * rates[level - 1]
+            commissions = {referrer_id: int(coins) for referrer_id, coins in commissions.items() if int(coins) > 0}
+            LedgerProcessor.credit_many(commissions, "RE")
+
+            ReferralEarning.objects.filter(id__in=[earning_id for earning_id, _, _ in earnings]).delete()
+        return len(earnings)
+
+
+class LeagueLeaderboard:
+    PERIODS = {
+        "day": ("total_earned_day", "earned_day_key"),
+        "week": ("total_earned_week", "earned_week_key"),
+    }
+
+    @classmethod
+    def current_key(cls, time_period: str) -> int:
+        today = day_key(time.time())
+        return today if time_period == "day" else week_key(today)
+
+    @classmethod
+    def get_page(cls, league_id, time_period: str, limit: int, cursor=None):
+        """
+        One page of the league ranking for the current day or week, ordered
+        by coins earned in that period. cursor is the (earned, telegram_id)
+        pair of the last row of the previous page.
+        """
+        earned_field, key_field = cls.PERIODS[time_period]
+        players = Player.objects.filter(
+            league_id=league_id, **{key_field: cls.current_key(time_period)}
+        ).order_by(f"-{earned_field}", "-telegram_id")
+        if cursor is not None:
+            earned, telegram_id = cursor
+            players = players.filter(
+                Q(**{f"{earned_field}__lt": earned})
+                | Q(**{earned_field: earned, "telegram_id__lt": telegram_id})
+            )
+        rows = list(players.values("telegram_id", "name", earned_field)[:limit])
+        next_cursor = None
+        if len(rows) == limit:
+            next_cursor = f"{rows[-1][earned_field]}:{rows[-1]['telegram_id']}"
+        return rows, next_cursor
+
+
+class LeagueRankProcessor:
+    @classmethod
+    def rebuild(cls, league_id: int, batch_size: int = 5000) -> int:
+        """Replace the rank snapshot of one league in a single transaction."""
+        players = (
+            Player.objects.filter(league_id=league_id)
+            .order_by("-total_coins_earned", "telegram_id")
+            .values_list("telegram_id", "total_coins_earned")
+        )
+        count = 0
+        with transaction.atomic():
+            # Players promoted since the last rebuild still have a row under
+            # their previous league.
+            LeagueRank.objects.filter(Q(league_id=league_id) | Q(player__league_id=league_id)).delete()
+            batch = []
+            for telegram_id, total_coins_earned in players.iterator(chunk_size=batch_size):
+                count += 1
+                batch.append(
+                    LeagueRank(
+                        player_id=telegram_id,
+                        league_id=league_id,
+                        rank=count,
+                        total_coins_earned=total_coins_earned,
+                    )
+                )
+                if len(batch) >= batch_size:
+                    LeagueRank.objects.bulk_create(batch)
+                    batch = []
+            LeagueRank.objects.bulk_create(batch)
+        return count
+
+    @classmethod
+    def get_rank(cls, telegram_id, neighbours: int):
+        try:
+            own = LeagueRank.objects.get(player_id=telegram_id)
+        except LeagueRank.DoesNotExist:
+            return None
+        around = list(
+            LeagueRank.objects.filter(
+                league_id=own.league_id,
+                rank__gte=own.rank - neighbours,
+                rank__lte=own.rank + neighbours,
+            )
+            .order_by("rank")
+            .values("rank", "player_id", "player__name", "total_coins_earned")
+        )
+        return {
+            "league": own.league_id,
+            "rank": own.rank,
+            "total_coins_earned": own.total_coins_earned,
+            "neighbours": [
+                {
+                    "rank": row["rank"],
+                    "telegram_id": row["player_id"],
+                    "name": row["player__name"],
+                    "total_coins_earned": row["total_coins_earned"],
+                }
+                for row in around
+            ],
+        }
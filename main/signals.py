@@ -0,0 +1,98 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from .catalog import CatalogVersion
+from .models import League, Meme, Player, Task, Team
+from .player_cache import player_state_cache
+from .processors import EarningsProcessor, FriendsProcessor, MemeProcessor, TeamProcessor
+
+
+@receiver([post_save, post_delete], sender=League)
+def bump_league_version(sender, **kwargs):
+    CatalogVersion.bump_on_commit("league")
+
+
+@receiver([post_save, post_delete], sender=Meme)
+def bump_meme_version(sender, **kwargs):
+    CatalogVersion.bump_on_commit("meme")
+
+
+@receiver(post_save, sender=Meme)
+def reprice_meme(sender, instance, created, **kwargs):
+    loaded = getattr(instance, "_loaded_values", {})
+    if created or not loaded:
+        return
+    if any(loaded.get(field) != getattr(instance, field) for field in ("coins_per_hour", "upgrade_price")):
+        # After the save commits, outside the transaction of the admin edit
+        transaction.on_commit(lambda: MemeProcessor.reprice(instance))
+
+
+@receiver([post_save, post_delete], sender=Task)
+def bump_task_version(sender, **kwargs):
+    CatalogVersion.bump_on_commit("task")
+
+
+@receiver([post_save, post_delete], sender=Team)
+def bump_team_version(sender, **kwargs):
+    # Only admin edits go through save(); coins_count changes are queryset
+    # updates and don't invalidate the team catalog.
+    CatalogVersion.bump_on_commit("team")
+
+
+@receiver([post_save, post_delete], sender=Player)
+def invalidate_player_state(sender, instance, **kwargs):
+    player_state_cache.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=Player)
+def commit_player_earnings(sender, instance, **kwargs):
+    EarningsProcessor.commit([instance])
+
+
+@receiver(post_save, sender=Player)
+def count_referral(sender, instance, created, **kwargs):
+    if "referred_by_id" not in instance.__dict__:
+        return
+    if created:
+        old_referrer_id = None
+    elif "referred_by_id" in getattr(instance, "_loaded_values", {}):
+        old_referrer_id = instance._loaded_values["referred_by_id"]
+    else:
+        # Saved without being loaded first, the previous referrer is unknown
+        return
+    FriendsProcessor.move_referral(old_referrer_id, instance.referred_by_id)
+
+
+@receiver(post_delete, sender=Player)
+def remove_player_from_team(sender, instance, **kwargs):
+    if instance.team_id is not None:
+        TeamProcessor.add_coins({instance.team_id: -instance.total_coins_earned})
+    FriendsProcessor.move_referral(instance.__dict__.get("referred_by_id"), None)
+
+
+@receiver(pre_delete, sender=Player)
+def uncount_deleted_friendships(sender, instance, **kwargs):
+    # The cascade deletes the friendship rows without m2m_changed signals
+    FriendsProcessor.removing(instance.pk)
+
+
+@receiver(m2m_changed, sender=Player.friends.through)
+def prevent_self_friendship(sender, instance, action, pk_set, **kwargs):
+    if action == "pre_add" and instance.pk in pk_set:
+        pk_set.discard(instance.pk)
+        # The mirror insert of a symmetrical add doesn't send signals, so the
+        # (player, player) row it writes is removed once the add commits.
+        transaction.on_commit(
+            lambda: sender.objects.filter(from_player_id=instance.pk, to_player_id=instance.pk).delete()
+        )
+
+
+@receiver(m2m_changed, sender=Player.friends.through)
+def count_friends(sender, instance, action, pk_set, **kwargs):
+    if action == "post_add":
+        FriendsProcessor.added(instance.pk, pk_set)
+    elif action == "pre_remove":
+        FriendsProcessor.removing(instance.pk, pk_set)
+    elif action == "pre_clear":
+        FriendsProcessor.removing(instance.pk)
@@ -0,0 +1,139 @@
+import logging
+import threading
+import time
+from datetime import timedelta
+
+import requests
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import OutboundMessage
+
+logger = logging.getLogger(__name__)
+
+
+class TelegramError(Exception):
+    def __init__(self, message, retry_after=None, permanent=False):
+        super().__init__(message)
+        self.retry_after = retry_after
+        self.permanent = permanent
+
+
+class HttpTransport:
+    """Bot API client over one reused HTTP session."""
+
+    def __init__(self, api_url=None, token=None, timeout=10):
+        self.api_url = (api_url or settings.TELEGRAM_API_URL).rstrip("/")
+        self.token = token or settings.TELEGRAM_API_TOKEN
+        if not self.token:
+            raise ImproperlyConfigured("TELEGRAM_API_TOKEN is not set, outbound messages can't be sent.")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send_message(self, chat_id: int, text: str):
+        try:
+            response = self.session.post(
+                f"{self.api_url}/bot{self.token}/sendMessage",
+                json={"chat_id": chat_id, "text": text},
+                timeout=self.timeout,
+            )
+            body = response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise TelegramError(str(e))
+        if not body.get("ok"):
+            parameters = body.get("parameters") or {}
+            raise TelegramError(
+                body.get("description", f"HTTP {response.status_code}"),
+                retry_after=parameters.get("retry_after"),
+                # 400/403 mean a bad chat or a user who blocked the bot,
+                # retrying won't help.
+                permanent=response.status_code in (400, 403),
+            )
+        return body.get("result")
+
+
+class MemoryTransport:
+    """Records messages instead of sending them, for tests and local runs."""
+
+    def __init__(self, **kwargs):
+        self.sent = []
+
+    def send_message(self, chat_id: int, text: str):
+        self.sent.append((chat_id, text))
+        return {"chat": {"id": chat_id}, "text": text}
+
+
+def get_transport():
+    return import_string(settings.TELEGRAM_TRANSPORT)()
+
+
+class RateLimiter:
+    def __init__(self, per_second: float):
+        self.interval = 1 / per_second if per_second else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
+class OutboundQueue:
+    MAX_ATTEMPTS = 8
+    BASE_BACKOFF = 2
+    MAX_BACKOFF = 600
+    # A claimed message is hidden from other workers for this long, so a
+    # crashed worker's batch is picked up again.
+    LEASE = 60
+
+    @classmethod
+    def enqueue(cls, chat_id, text: str) -> OutboundMessage:
+        return OutboundMessage.objects.create(chat_id=chat_id, text=text)
+
+    @classmethod
+    def claim(cls, batch_size: int):
+        now = timezone.now()
+        with transaction.atomic():
+            messages = list(
+                OutboundMessage.objects.select_for_update(skip_locked=True)
+                .filter(status="PE", next_attempt_at__lte=now)
+                .order_by("next_attempt_at", "id")[:batch_size]
+            )
+            OutboundMessage.objects.filter(id__in=[message.id for message in messages]).update(
+                next_attempt_at=now + timedelta(seconds=cls.LEASE)
+            )
+        return messages
+
+    @classmethod
+    def drain(cls, transport, rate_limiter: RateLimiter, batch_size: int = 100) -> int:
+        """Send one batch of due messages, returns how many were processed."""
+        messages = cls.claim(batch_size)
+        for message in messages:
+            rate_limiter.wait()
+            try:
+                transport.send_message(message.chat_id, message.text)
+            except TelegramError as e:
+                cls._failed(message, e)
+            else:
+                message.status = "SE"
+                message.sent_at = timezone.now()
+            message.attempts += 1
+            message.save(update_fields=["status", "attempts", "next_attempt_at", "last_error", "sent_at"])
+        return len(messages)
+
+    @classmethod
+    def _failed(cls, message: OutboundMessage, error: TelegramError):
+        logger.warning("Telegram message %s to %s failed: %s", message.id, message.chat_id, error)
+        message.last_error = str(error)[:1023]
+        if error.permanent or message.attempts + 1 >= cls.MAX_ATTEMPTS:
+            message.status = "FA"
+            return
+        delay = error.retry_after or min(cls.BASE_BACKOFF * 2 ** message.attempts, cls.MAX_BACKOFF)
+        message.next_attempt_at = timezone.now() + timedelta(seconds=delay)
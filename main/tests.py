@@ -1,3 +1,468 @@
-from django.test import TestCase
+import time
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.admin.sites import site
+from django.core.cache import cache, caches
+from django.db import DatabaseError
+from django.test import Client, RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from .catalog import active_task_catalog, league_ladder, meme_catalog
+from .models import (
+    CoinLedger,
+    CoinLedgerArchive,
+    League,
+    Meme,
+    MemePlayer,
+    OutboundMessage,
+    Player,
+    PlayerTask,
+    ReferralEarning,
+    Task,
+    Team,
+)
+from .player_cache import player_state_cache
+from .processors import (
+    MAX_BOOSTS_COUNT,
+    LedgerProcessor,
+    MemeProcessor,
+    PlayerProcessor,
+    ReferralProcessor,
+    TeamProcessor,
+    day_key,
+)
+from .telegram import MemoryTransport, OutboundQueue, RateLimiter, TelegramError
+from .views import UPGRADE_PRICES
+from .write_behind import PlayerSyncBuffer
+
+
+class GameTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.bronze = League.objects.create(name="Bronze", level=1, coin_limit=0)
+        cls.silver = League.objects.create(name="Silver", level=2, coin_limit=1000)
+        cls.gold = League.objects.create(name="Gold", level=3, coin_limit=5000)
+        cls.team = Team.objects.create(name="Alpha")
+        cls.meme = Meme.objects.create(name="Doge", coins_per_hour=100, upgrade_price=1000, logo="doge.png")
+        cls.task = Task.objects.create(name="Follow", description="Follow the channel", link="https://t.me/x")
+
+    def setUp(self):
+        # Module level caches outlive the rolled back test transactions
+        for catalog in (league_ladder, meme_catalog, active_task_catalog):
+            catalog.invalidate()
+        player_state_cache.clear()
+        cache.clear()
+        self.client = Client()
+        self.player = self.create_player(1, "alice")
+
+    def create_player(self, telegram_id, name, **fields):
+        fields.setdefault("league", self.bronze)
+        fields.setdefault("last_seen", int(time.time()))
+        return Player.objects.create(telegram_id=telegram_id, name=name, **fields)
+
+    def reload(self, player):
+        return Player.objects.get(pk=player.pk)
+
+
+class QueryCountTests(GameTestCase):
+    def warm_up(self):
+        # Loads the catalogs, so the counts below are those of a warm worker
+        self.client.get("/bootstrap/", {"user_id": self.player.pk})
+
+    def test_session_start_only_reads_an_unchanged_player(self):
+        self.warm_up()
+        with self.assertNumQueries(1):
+            response = self.client.get("/initialize_user/", {"user_id": self.player.pk})
+        self.assertEqual(response.status_code, 200)
+
+    def test_session_start_saves_passive_income(self):
+        self.warm_up()
+        Player.objects.filter(pk=self.player.pk).update(total_coins_per_hour=3600, last_seen=int(time.time()) - 100)
+        with self.assertNumQueries(6):
+            response = self.client.get("/initialize_user/", {"user_id": self.player.pk})
+        self.assertGreaterEqual(response.json()["passive_income"], 100)
+        self.assertGreaterEqual(self.reload(self.player).coins_balance, 100)
+
+    def test_tap_sync(self):
+        self.warm_up()
+        with self.assertNumQueries(4):
+            response = self.client.post(
+                "/update_coins_and_energy/", {"user_id": self.player.pk, "coins_count": 50, "energy_count": 900}
+            )
+        self.assertEqual(response.status_code, 200)
+        player = self.reload(self.player)
+        self.assertEqual((player.coins_balance, player.total_coins_earned, player.energy_balance), (50, 50, 900))
+
+    def test_bootstrap(self):
+        self.warm_up()
+        with self.assertNumQueries(3):
+            response = self.client.get("/bootstrap/", {"user_id": self.player.pk})
+        self.assertEqual(set(response.json()), {
+            "player", "boosts", "upgrades", "memes", "tasks", "leagues", "friends_count",
+        })
+
+    def test_meme_lists_dont_grow_with_the_memes(self):
+        for meme_count in (1, 6):
+            for index in range(Meme.objects.count(), meme_count):
+                Meme.objects.create(name=f"Meme {index}", coins_per_hour=10, upgrade_price=100, logo="meme.png")
+            for meme in Meme.objects.exclude(memeplayer__player=self.player):
+                MemePlayer.objects.create(
+                    player=self.player, meme=meme, current_coins_per_hour=10, current_upgrade_cost=200
+                )
+            # The version bump waits for a commit that never comes in a TestCase
+            meme_catalog.invalidate()
+            self.warm_up()
+            # Caches the player row as well
+            self.client.get("/get_player_memes", {"user_id": self.player.pk})
+            with self.subTest(memes=meme_count):
+                with self.assertNumQueries(1):
+                    response = self.client.get("/get_player_memes", {"user_id": self.player.pk})
+                self.assertEqual(len(response.json()["memes"]), meme_count)
+                with self.assertNumQueries(3):
+                    response = self.client.get("/bootstrap/", {"user_id": self.player.pk})
+                self.assertEqual(len(response.json()["memes"]), meme_count)
+
+    def test_bootstrap_sections(self):
+        response = self.client.get("/bootstrap/", {"user_id": self.player.pk, "sections": "player,memes"})
+        self.assertEqual(set(response.json()), {"player", "memes"})
+        response = self.client.get("/bootstrap/", {"user_id": self.player.pk, "sections": "player,nope"})
+        self.assertEqual(response.status_code, 400)
+
+
+class ConditionalDebitTests(GameTestCase):
+    def test_buy_upgrade_debits_and_levels_up(self):
+        Player.objects.filter(pk=self.player.pk).update(coins_balance=UPGRADE_PRICES[0] + 5)
+        response = self.client.post("/buy_upgrade/", {"user_id": self.player.pk, "upgrade": "multitap"})
+        self.assertEqual(response.status_code, 200)
+        player = self.reload(self.player)
+        self.assertEqual((player.coins_balance, player.multitap_level), (5, 2))
+
+    def test_buy_upgrade_without_the_coins_changes_nothing(self):
+        Player.objects.filter(pk=self.player.pk).update(coins_balance=UPGRADE_PRICES[0] - 1)
+        response = self.client.post("/buy_upgrade/", {"user_id": self.player.pk, "upgrade": "multitap"})
+        self.assertEqual(response.status_code, 400)
+        player = self.reload(self.player)
+        self.assertEqual((player.coins_balance, player.multitap_level), (UPGRADE_PRICES[0] - 1, 1))
+
+    def test_buy_upgrade_spends_unfolded_credits(self):
+        LedgerProcessor.credit(self.player.pk, UPGRADE_PRICES[0], "TA")
+        response = self.client.post("/buy_upgrade/", {"user_id": self.player.pk, "upgrade": "energyLimit"})
+        self.assertEqual(response.status_code, 200)
+        player = self.reload(self.player)
+        self.assertEqual((player.coins_balance, player.energy_limit_level), (0, 2))
+        self.assertFalse(CoinLedger.objects.exists())
+        self.assertTrue(CoinLedgerArchive.objects.filter(player=player, delta=-UPGRADE_PRICES[0], reason="UP").exists())
+
+    def test_use_boost_stops_at_zero(self):
+        for remaining in range(MAX_BOOSTS_COUNT - 1, -1, -1):
+            self.assertEqual(PlayerProcessor.use_boost(self.player.pk, "rocket"), remaining)
+        self.assertIsNone(PlayerProcessor.use_boost(self.player.pk, "rocket"))
+        self.assertEqual(self.reload(self.player).rocket_count, 0)
+
+    def test_use_boost_view_refuses_an_empty_counter(self):
+        Player.objects.filter(pk=self.player.pk).update(rocket_count=0, boosts_reset_day=day_key(time.time()))
+        response = self.client.post("/use_boost/", {"user_id": self.player.pk, "boost": "rocket"})
+        self.assertEqual(response.status_code, 406)
+        self.assertEqual(self.reload(self.player).rocket_count, 0)
+
+    def test_use_boost_refills_a_new_day(self):
+        yesterday = day_key(time.time()) - 1
+        Player.objects.filter(pk=self.player.pk).update(rocket_count=0, full_energy_count=0, boosts_reset_day=yesterday)
+        self.assertEqual(PlayerProcessor.use_boost(self.player.pk, "rocket"), MAX_BOOSTS_COUNT - 1)
+        player = self.reload(self.player)
+        self.assertEqual((player.rocket_count, player.full_energy_count), (MAX_BOOSTS_COUNT - 1, MAX_BOOSTS_COUNT))
+        self.assertEqual(player.boosts_reset_day, yesterday + 1)
+
+    def test_manage_meme_buys_then_upgrades(self):
+        # The purchase price, then the stored cost of level 2
+        Player.objects.filter(pk=self.player.pk).update(coins_balance=1000 + 4000)
+        response = self.client.post("/manage_meme/", {"user_id": self.player.pk, "meme_id": self.meme.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["player_coins_balance"], 4000)
+        response = self.client.post("/manage_meme/", {"user_id": self.player.pk, "meme_id": self.meme.pk})
+        self.assertEqual(response.status_code, 200)
+        owned = MemePlayer.objects.get(player=self.player, meme=self.meme)
+        player = self.reload(self.player)
+        self.assertEqual((owned.current_level, player.coins_balance), (2, 0))
+        self.assertEqual(player.total_coins_per_hour, owned.current_coins_per_hour)
+
+    def test_manage_meme_without_the_coins_changes_nothing(self):
+        Player.objects.filter(pk=self.player.pk).update(coins_balance=999)
+        response = self.client.post("/manage_meme/", {"user_id": self.player.pk, "meme_id": self.meme.pk})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.reload(self.player).coins_balance, 999)
+        self.assertFalse(MemePlayer.objects.exists())
+
+
+class PassiveIncomeTests(GameTestCase):
+    def test_a_new_meme_only_earns_from_its_purchase(self):
+        Player.objects.filter(pk=self.player.pk).update(coins_balance=1000, last_seen=int(time.time()) - 5 * 3600)
+        self.assertEqual(self.client.get("/initialize_user/", {"user_id": self.player.pk}).json()["passive_income"], 0)
+        meme = Meme.objects.create(name="Pepe", coins_per_hour=3600, upgrade_price=1000, logo="pepe.png")
+        response = self.client.post("/manage_meme/", {"user_id": self.player.pk, "meme_id": meme.pk})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get("/initialize_user/", {"user_id": self.player.pk})
+        self.assertLess(response.json()["passive_income"], 10)
+
+    def test_buying_a_meme_settles_the_old_rate(self):
+        Player.objects.filter(pk=self.player.pk).update(
+            coins_balance=1000, total_coins_per_hour=3600, last_seen=int(time.time()) - 100
+        )
+        response = self.client.post("/manage_meme/", {"user_id": self.player.pk, "meme_id": self.meme.pk})
+        self.assertGreaterEqual(response.json()["player_coins_balance"], 100)
+        self.assertGreaterEqual(CoinLedger.objects.get(player=self.player, reason="PI").delta, 100)
+        player = self.reload(self.player)
+        self.assertEqual((player.coins_balance, player.total_coins_per_hour), (0, 3700))
+        self.assertGreaterEqual(player.last_seen, int(time.time()) - 1)
+
+    def test_reprice_settles_the_old_rate(self):
+        MemePlayer.objects.create(
+            player=self.player, meme=self.meme, current_level=1, current_coins_per_hour=100, current_upgrade_cost=2000
+        )
+        Player.objects.filter(pk=self.player.pk).update(total_coins_per_hour=100, last_seen=int(time.time()) - 3600)
+        self.meme.coins_per_hour = 200
+        self.assertEqual(MemeProcessor.reprice(self.meme), 1)
+        self.assertEqual(CoinLedger.objects.get(player=self.player, reason="PI").delta, 100)
+        player = self.reload(self.player)
+        self.assertEqual(player.total_coins_per_hour, 200)
+        self.assertGreaterEqual(player.last_seen, int(time.time()) - 1)
+
+
+class LedgerFoldTests(GameTestCase):
+    def test_task_reward_counts_before_and_after_the_fold(self):
+        Player.objects.filter(pk=self.player.pk).update(team=self.team, coins_balance=100)
+        player_task = PlayerTask.objects.create(player=self.player, task=self.task, status="AV")
+        Task.objects.filter(pk=self.task.pk).update(coins_reward=1500)
+        self.assertEqual(self.client.post("/complete_task/", {"task_id": player_task.pk}).status_code, 200)
+
+        response = self.client.get("/initialize_user/", {"user_id": self.player.pk})
+        self.assertEqual(response.json()["coins_count"], 1600)
+        # The client reports the credit it was shown plus 10 taps
+        self.client.post("/update_coins_and_energy/", {"user_id": self.player.pk, "coins_count": 1610, "energy_count": 1})
+        self.assertEqual(self.reload(self.player).coins_balance, 110)
+
+        self.assertEqual(LedgerProcessor.fold(), 1)
+        player = self.reload(self.player)
+        self.assertEqual((player.coins_balance, player.total_coins_earned), (1610, 1510))
+        self.assertEqual(player.league_id, self.silver.pk)
+        self.assertEqual(Team.objects.get(pk=self.team.pk).coins_count, 1510)
+        self.assertFalse(CoinLedger.objects.exists())
+        self.assertEqual(CoinLedgerArchive.objects.get(reason="TA").delta, 1500)
+
+    def test_fold_records_referral_earnings(self):
+        referrer = self.create_player(2, "bob")
+        Player.objects.filter(pk=self.player.pk).update(referred_by=referrer)
+        LedgerProcessor.credit(self.player.pk, 300, "TA")
+        LedgerProcessor.fold()
+        self.assertEqual(ReferralEarning.objects.get(player=self.player).coins, 300)
+
+
+@override_settings(REFERRAL_COMMISSION_RATES=(0.1, 0.05, 0.02))
+class ReferralCommissionTests(GameTestCase):
+    def test_commissions_go_up_the_chain_through_the_ledger(self):
+        # alice <- bob <- carol <- dave <- erin, erin is past the last level
+        erin = self.create_player(5, "erin")
+        dave = self.create_player(4, "dave", referred_by=erin)
+        carol = self.create_player(3, "carol", referred_by=dave)
+        bob = self.create_player(2, "bob", referred_by=carol, team=self.team)
+        Player.objects.filter(pk=self.player.pk).update(referred_by=bob)
+        ReferralEarning.objects.create(player=self.player, coins=600)
+        ReferralEarning.objects.create(player=self.player, coins=400)
+
+        self.assertEqual(ReferralProcessor.pay_batch(), 2)
+        self.assertFalse(ReferralEarning.objects.exists())
+        self.assertEqual(
+            dict(CoinLedger.objects.filter(reason="RE").values_list("player_id", "delta")),
+            {bob.pk: 100, carol.pk: 50, dave.pk: 20},
+        )
+
+        # Shown before the fold and kept by bob's next tap sync
+        response = self.client.get("/initialize_user/", {"user_id": bob.pk})
+        self.assertEqual(response.json()["coins_count"], 100)
+        self.client.post("/update_coins_and_energy/", {"user_id": bob.pk, "coins_count": 110, "energy_count": 1})
+
+        self.assertEqual(LedgerProcessor.fold(), 3)
+        bob = self.reload(bob)
+        self.assertEqual((bob.coins_balance, bob.total_coins_earned, bob.total_earned_day), (110, 110, 110))
+        self.assertEqual(Team.objects.get(pk=self.team.pk).coins_count, 110)
+        # Only bob's taps earn commissions, not the commission paid to bob
+        self.assertEqual(list(ReferralEarning.objects.values_list("player_id", "coins")), [(bob.pk, 10)])
+        self.assertEqual(self.reload(erin).coins_balance, 0)
+
+
+class FriendCounterTests(GameTestCase):
+    def test_friendships_are_counted_on_both_sides(self):
+        bob = self.create_player(2, "bob")
+        carol = self.create_player(3, "carol")
+        self.player.friends.add(bob, carol, self.player)
+        counts = dict(Player.objects.values_list("pk", "friends_count"))
+        self.assertEqual(counts, {self.player.pk: 2, bob.pk: 1, carol.pk: 1})
+
+        self.player.friends.remove(bob)
+        counts = dict(Player.objects.values_list("pk", "friends_count"))
+        self.assertEqual(counts, {self.player.pk: 1, bob.pk: 0, carol.pk: 1})
+
+        carol.delete()
+        self.assertEqual(self.reload(self.player).friends_count, 0)
+
+    def test_referrals_follow_referred_by(self):
+        bob = self.create_player(2, "bob")
+        carol = self.create_player(3, "carol", referred_by=self.player)
+        self.assertEqual(self.reload(self.player).referrals_count, 1)
+
+        carol = self.reload(carol)
+        carol.referred_by = bob
+        carol.save()
+        self.assertEqual((self.reload(self.player).referrals_count, self.reload(bob).referrals_count), (0, 1))
+
+        carol.delete()
+        self.assertEqual(self.reload(bob).referrals_count, 0)
+        response = self.client.get("/friends_reffered_count/", {"user_id": bob.pk})
+        self.assertEqual(response.json(), {"friends_reffered_count": 0, "referrals_count": 0})
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "default"},
+        "shared": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "shared"},
+    },
+    CATALOG_CACHE="shared",
+)
+class TeamLeaderboardTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        caches["shared"].clear()
+
+    def test_snapshot_lives_in_the_shared_cache(self):
+        self.assertEqual(TeamProcessor.refresh_leaderboard(), [{"id": self.team.pk, "name": "Alpha"}])
+        self.assertIsNone(caches["default"].get(TeamProcessor.LEADERBOARD_CACHE_KEY))
+
+        # Served from the snapshot until it is rebuilt
+        Team.objects.create(name="Beta", coins_count=10)
+        self.assertEqual([team["name"] for team in TeamProcessor.get_top_teams(10)], ["Alpha"])
+        caches["shared"].clear()
+        self.assertEqual([team["name"] for team in TeamProcessor.get_top_teams(10)], ["Beta", "Alpha"])
+
+
+class PlayerAdminSearchTests(GameTestCase):
+    def search(self, term):
+        queryset, _ = site._registry[Player].get_search_results(RequestFactory().get("/"), Player.objects.all(), term)
+        return sorted(queryset.values_list("name", flat=True))
+
+    def test_name_prefix_ignores_case(self):
+        self.create_player(2, "Alfred")
+        self.create_player(3, "malice")
+        self.assertEqual(self.search("AL"), ["Alfred", "alice"])
+        self.assertEqual(self.search("al_"), [])
+        self.assertEqual(self.search("2"), ["Alfred"])
+
+
+class PlayerSyncBufferTests(GameTestCase):
+    def setUp(self):
+        super().setUp()
+        # Flushed by the tests themselves, not by a background thread
+        patcher = mock.patch.object(PlayerSyncBuffer, "_start")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.buffer = PlayerSyncBuffer(flush_interval=60, max_pending=2)
+
+    def test_syncs_collapse_into_one_write(self):
+        for coins in (100, 200, 300):
+            self.buffer.enqueue(self.player.pk, coins, 900, int(time.time()))
+        self.assertEqual(self.reload(self.player).coins_balance, 0)
+        self.buffer.flush()
+        player = self.reload(self.player)
+        self.assertEqual((player.coins_balance, player.total_coins_earned, player.energy_balance), (300, 300, 900))
+
+    def test_max_pending_wakes_the_flusher(self):
+        self.buffer.enqueue(self.player.pk, 100, 900, int(time.time()))
+        self.assertFalse(self.buffer._wake.is_set())
+        bob = self.create_player(2, "bob")
+        self.buffer.enqueue(bob.pk, 100, 900, int(time.time()))
+        self.assertTrue(self.buffer._wake.is_set())
+
+    def test_failed_flush_requeues_unless_a_newer_sync_arrived(self):
+        bob = self.create_player(2, "bob")
+        self.buffer.enqueue(self.player.pk, 100, 900, int(time.time()))
+        self.buffer.enqueue(bob.pk, 100, 900, int(time.time()))
+
+        def fail(*args, **kwargs):
+            self.buffer.enqueue(bob.pk, 250, 800, int(time.time()))
+            raise DatabaseError("connection lost")
+
+        with mock.patch.object(Player.objects, "bulk_update", side_effect=fail):
+            with self.assertRaises(DatabaseError):
+                self.buffer.flush()
+        self.buffer.flush()
+        balances = dict(Player.objects.values_list("pk", "coins_balance"))
+        self.assertEqual((balances[self.player.pk], balances[bob.pk]), (100, 250))
+
+    def test_a_debit_since_the_sync_is_kept(self):
+        Player.objects.filter(pk=self.player.pk).update(coins_balance=1000, total_coins_earned=1000)
+        self.buffer.enqueue(self.player.pk, 1050, 900, int(time.time()))
+        # Another worker's purchase lands before the flush
+        Player.objects.filter(pk=self.player.pk).update(coins_balance=200)
+        self.buffer.flush()
+        player = self.reload(self.player)
+        self.assertEqual((player.coins_balance, player.total_coins_earned), (200, 1000))
+
+
+class FailingTransport(MemoryTransport):
+    """Raises the given errors, one per message, then records like MemoryTransport."""
+
+    def __init__(self, *errors):
+        super().__init__()
+        self.errors = list(errors)
+
+    def send_message(self, chat_id: int, text: str):
+        if self.errors:
+            raise self.errors.pop(0)
+        return super().send_message(chat_id, text)
+
+
+class OutboundQueueTests(TestCase):
+    def drain(self, transport):
+        return OutboundQueue.drain(transport, RateLimiter(0))
+
+    def assertRetriesIn(self, message, seconds):
+        delay = (message.next_attempt_at - timezone.now()).total_seconds()
+        self.assertAlmostEqual(delay, seconds, delta=5)
+
+    def test_delivery(self):
+        OutboundQueue.enqueue(1, "hello")
+        transport = MemoryTransport()
+        self.assertEqual(self.drain(transport), 1)
+        self.assertEqual(transport.sent, [(1, "hello")])
+        message = OutboundMessage.objects.get()
+        self.assertEqual((message.status, message.attempts), ("SE", 1))
+        self.assertIsNotNone(message.sent_at)
+        self.assertEqual(self.drain(transport), 0)
+
+    def test_retry_after_and_backoff(self):
+        OutboundQueue.enqueue(1, "hello")
+        self.drain(FailingTransport(TelegramError("Too Many Requests", retry_after=30)))
+        message = OutboundMessage.objects.get()
+        self.assertEqual((message.status, message.attempts, message.last_error), ("PE", 1, "Too Many Requests"))
+        self.assertRetriesIn(message, 30)
+        # Not due yet
+        self.assertEqual(self.drain(MemoryTransport()), 0)
+
+        OutboundMessage.objects.update(next_attempt_at=timezone.now() - timedelta(seconds=1))
+        self.drain(FailingTransport(TelegramError("Bad Gateway")))
+        message = OutboundMessage.objects.get()
+        self.assertEqual((message.status, message.attempts), ("PE", 2))
+        self.assertRetriesIn(message, OutboundQueue.BASE_BACKOFF * 2)
+
+    def test_permanent_failure_is_not_retried(self):
+        OutboundQueue.enqueue(666, "hello")
+        self.drain(FailingTransport(TelegramError("Forbidden: bot was blocked", permanent=True)))
+        message = OutboundMessage.objects.get()
+        self.assertEqual((message.status, message.attempts), ("FA", 1))
+
+    def test_gives_up_after_max_attempts(self):
+        OutboundQueue.enqueue(1, "hello")
+        OutboundMessage.objects.update(attempts=OutboundQueue.MAX_ATTEMPTS - 1)
+        self.drain(FailingTransport(TelegramError("Bad Gateway")))
+        message = OutboundMessage.objects.get()
+        self.assertEqual((message.status, message.attempts), ("FA", OutboundQueue.MAX_ATTEMPTS))
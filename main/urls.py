@@ -1,6 +1,9 @@
+from django.conf import settings
 from django.urls import path
+from .metrics import metrics
 from .views import (
     initialize_user,
+    bootstrap,
     get_task,
     complete_task,
     update_coins_and_energy,
@@ -17,14 +20,26 @@ from .views import (
     leave_team,
     get_top_teams,
     get_all_leagues,
+    get_league,
+    get_league_rank,
     get_player_memes,
     get_player_energy,
     manage_meme,
     send_invite_message
 )
 
+if settings.ASYNC_HOT_READS:
+    from .async_views import (
+        initialize_user,
+        get_player_energy,
+        get_user_boosts,
+        get_user_upgrades,
+        friends_list,
+    )
+
 urlpatterns = [
     path('initialize_user/', initialize_user, name='initialize_user'),
+    path('bootstrap/', bootstrap, name='bootstrap'),
     path('get_task/', get_task, name='get_task'),
     path('complete_task/', complete_task, name='complete_task'),
     path('update_coins_and_energy/', update_coins_and_energy, name='update_coins_and_energy'),
@@ -41,9 +56,12 @@ urlpatterns = [
     path('leave_team/', leave_team, name='leave_team'),
     path('get_top5_teams/', get_top_teams, name='get_top5_teams'),
     path('get_all_leagues/', get_all_leagues, name='get_all_leagues'),
+    path('get_league/', get_league, name='get_league'),
+    path('get_league_rank/', get_league_rank, name='get_league_rank'),
     path('get_player_memes', get_player_memes, name='get_player_memes'),
     path('get_player_energy', get_player_energy, name='get_player_energy'),
     path('manage_meme/', manage_meme, name='manage_meme'),
-    path('send_invite_message/', send_invite_message, name='send_invite')
+    path('send_invite_message/', send_invite_message, name='send_invite'),
+    path('metrics/', metrics, name='metrics'),
     # path()
 ]
\ No newline at end of file
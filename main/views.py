@@ -14,19 +14,28 @@ from django.core.exceptions import ObjectDoesNotExist
 from django.db.models import F
 from django.views.decorators.csrf import csrf_exempt
 from django.db.models import Sum
-from django.db import transaction
+from django.db import IntegrityError, transaction
 from datetime import datetime, date, timedelta
 import pytz
 import time
 from typing import Callable
-import telebot
+from django.conf import settings
+from .processors import (
+    FriendsProcessor,
+    LeagueLeaderboard,
+    LedgerProcessor,
+    LeagueRankProcessor,
+    PlayerProcessor,
+    TeamProcessor,
+    day_key,
+)
+from .write_behind import player_sync_buffer
+from .catalog import CatalogResponseCache, active_task_catalog, league_ladder, meme_catalog
+from .telegram import OutboundQueue
+from .db import update_returning
+from .player_cache import player_state_cache
 
 # Create your views here.
-API_TOKEN = "7018093041:AAF-1Nkt9NJd8LjUvfyN2s378jv8u9W4u1A"
-HOUR = 3600
-ENERGY_MULTIPLIER = 1000
-FULL_ENERGY: Callable[[Player], int] = lambda player: player.energy_limit_level*ENERGY_MULTIPLIER
-MAX_BOOSTS_COUNT = 3
 UPGRADE_PRICES = [
         10000, 
         20000, 
@@ -44,129 +53,59 @@ UPGRADE_PRICES = [
         81920000, 
         163840000]
 
-class PlayerProcessor:
-    @classmethod 
-    def next_League_check(cls, player: Player) -> Player:
-        try:
-            next_league = LeagueProcessor.get_next_league(player.league.level)
-        except:
-            return player
-        if next_league:
-            if player.total_coins_earned >= next_league.coin_limit:
-                player.league = next_league
-        return player
-
-    @classmethod
-    def update_coins(cls, player: Player, new_coins_count) -> Player:
-        if new_coins_count > player.coins_balance:
-            player.total_coins_earned += new_coins_count - player.coins_balance
-        player.coins_balance = new_coins_count
-        cls.next_League_check(player)
-        return player
-
-    @classmethod
-    def add_coins(cls, player: Player, coins_to_add: int) -> Player:
-        player.coins_balance += coins_to_add
-        player.total_coins_earned += coins_to_add
-        cls.next_League_check(player)
-        return player
-    
-    @classmethod
-    def calculate_passive_income(cls, player: Player, passive_income_per_hour):
-        current_time = int(time.time())
-        total_seconds_offline = current_time - player.last_seen
-        capped_seconds_offline = min(total_seconds_offline, 10800)
-        passive_income = (capped_seconds_offline / HOUR) * passive_income_per_hour
-
-        return int(passive_income)
-
-    @classmethod
-    def calculate_energy(cls, player: Player):
-        current_time = int(time.time())
-        total_seconds_offline = current_time - player.last_seen
-        energy_balance = player.recharging_speed_level * total_seconds_offline
-        player.energy_balance += int(energy_balance)
-        if player.energy_balance > FULL_ENERGY(player):
-            player.energy_balance = FULL_ENERGY(player)
-        return player
-
-    @classmethod
-    def __use_rocket(cls, player: Player):
-        rocket_count = player.rocket_count
-        success = False
-        if rocket_count > 0:
-            success = True
-            player.rocket_count = rocket_count - 1
-        return player, rocket_count - 1, success
-    
-    @classmethod
-    def __use_full_energy(cls, player: Player):
-        full_energy_count = player.full_energy_count
-        success = False
-        if full_energy_count > 0:
-            success = True
-            player.full_energy_count = full_energy_count - 1
-            player.energy_balance = FULL_ENERGY(player)
-        return player, full_energy_count - 1, success
-
-    @classmethod
-    def use_boost(cls, player: Player, boost_type: str):
-        boosts = {"rocket" : cls.__use_rocket, "full_energy" : cls.__use_full_energy}
-        player, new_boosts_count, success = boosts[boost_type](player)
-        return player, new_boosts_count, success
-
-    @classmethod
-    def update_boosts(cls, player: Player, timezone_str='Etc/GMT-2'):
-        timezone = pytz.timezone(timezone_str)
-        timestamp_date = datetime.fromtimestamp(player.last_seen, timezone).date()
-        today = datetime.now(timezone).date()
-        if timestamp_date < today:
-            player.rocket_count = MAX_BOOSTS_COUNT
-            player.full_energy_count = MAX_BOOSTS_COUNT
-        return player
-    
-    @classmethod
-    def calculate_passive_income(cls, player: Player):
-        current_time = int(time.time())
-        total_seconds_offline = current_time - player.last_seen
-        passive_income = (total_seconds_offline / 3600) * player.total_coins_per_hour
-        return int(passive_income)
-    
-class LeagueProcessor:
-    @classmethod
-    def get_next_league(cls, current_level: int):
-        league = League.objects.filter(level = (current_level+1)).first()
-        if league:
-            return league
-        return None
+def flush_pending_sync(telegram_id):
+    if settings.PLAYER_SYNC_WRITE_BEHIND and str(telegram_id).isdigit():
+        player_sync_buffer.flush_player(int(telegram_id))
 
 @csrf_exempt
 def send_invite_message(request):
-    bot = telebot.TeleBot(API_TOKEN)
     user_id = request.POST.get("user_id")
-    bot.send_message(user_id, f"Your invite link - https://t.me/Coin_Demo_Bot?start={user_id}")
+    OutboundQueue.enqueue(user_id, f"Your invite link - https://t.me/Coin_Demo_Bot?start={user_id}")
     return HttpResponse("Invite message sended", status=200)
 
-def initialize_user(request):
-    telegram_id = request.GET.get("user_id")
-
-    try:
-        player = Player.objects.get(telegram_id=telegram_id)
-    except:
-        return HttpResponse("Invalid telegram ID", status=400)
 
+def start_player_session(player: Player):
+    """
+    Credits passive income and refills daily boosts. Returns the passive income
+    and whether the player row changed and has to be saved: a player who earned
+    nothing and already got today's boosts is only read.
+    """
+    current_time = int(time.time())
     passive_income = PlayerProcessor.calculate_passive_income(player)
-    player = PlayerProcessor.add_coins(player, passive_income)
-    player = PlayerProcessor.calculate_energy(player)
-    player = PlayerProcessor.update_boosts(player)
-    player.last_seen = int(time.time())
-    player.save()
+    boosts_reset_day = player.boosts_reset_day
+    player = PlayerProcessor.update_boosts(player, day_key(current_time))
+    changed = passive_income > 0 or player.boosts_reset_day != boosts_reset_day
+    if changed:
+        player = PlayerProcessor.add_coins(player, passive_income)
+        player = PlayerProcessor.calculate_energy(player)
+        player.last_seen = current_time
+    return passive_income, changed
+
+def persist_player_session(telegram_id):
+    """
+    Start the session again on a locked copy of the player and save it.
+    Ledger folds update coins_balance under the same row lock, so the save
+    can't overwrite coins folded since the player was first read.
+    """
+    with transaction.atomic():
+        player = (
+            Player.objects.select_for_update(of=("self",))
+            .select_related("league", "team")
+            .get(telegram_id=telegram_id)
+        )
+        passive_income, changed = start_player_session(player)
+        if changed:
+            player.save()
+        player.pending_coins = LedgerProcessor.pending_for([player.pk]).get(player.pk, 0)
+    return player, passive_income
 
+def player_state_data(player: Player, passive_income: int) -> dict:
     res = {
         "name": player.name,
         # "league": player.league.name if player.league else "",
-        "coins_count": player.coins_balance,
-        "energy_count": player.energy_balance,
+        # Snapshot plus the ledger credits not folded yet
+        "coins_count": player.coins_balance + getattr(player, "pending_coins", 0),
+        "energy_count": PlayerProcessor.current_energy(player),
         "total_coins_earned": player.total_coins_earned,
         "coins_per_hour": player.total_coins_per_hour,
         "passive_income": passive_income
@@ -175,26 +114,81 @@ def initialize_user(request):
         res["league"] = {"id": player.league.id, "name": player.league.level, "logo": player.league.logo, "coin_limit": player.league.coin_limit, "level": player.league.level}
     if player.team:
         res["team"] = {"id":player.team.id, "name":player.team.name, "logo":player.team.logo, "total":player.team.coins_count}
+    return res
 
-    return JsonResponse(res)
+def initialize_user(request):
+    telegram_id = request.GET.get("user_id")
+    flush_pending_sync(telegram_id)
+
+    try:
+        player = (
+            Player.objects.select_related("league", "team")
+            .annotate(pending_coins=LedgerProcessor.pending_coins())
+            .get(telegram_id=telegram_id)
+        )
+    except:
+        return HttpResponse("Invalid telegram ID", status=400)
+
+    passive_income, changed = start_player_session(player)
+    if changed:
+        player, passive_income = persist_player_session(telegram_id)
+
+    return JsonResponse(player_state_data(player, passive_income))
+
+BOOTSTRAP_SECTIONS = ("player", "boosts", "upgrades", "memes", "tasks", "leagues", "friends_count")
+
+def bootstrap(request):
+    """
+    Everything the mini-app needs when it opens, in one round trip. Starts the
+    session the same way initialize_user does. ?sections=player,memes limits
+    the response to the listed sections, so clients can skip what they cache.
+    """
+    telegram_id = request.GET.get("user_id")
+    sections = request.GET.get("sections")
+    sections = set(sections.split(",")) if sections else set(BOOTSTRAP_SECTIONS)
+    unknown = sections - set(BOOTSTRAP_SECTIONS)
+    if unknown:
+        return JsonResponse({"error": f"Unknown sections: {', '.join(sorted(unknown))}"}, status=400)
+    flush_pending_sync(telegram_id)
+
+    try:
+        player = (
+            Player.objects.select_related("league", "team")
+            .annotate(pending_coins=LedgerProcessor.pending_coins())
+            .get(telegram_id=telegram_id)
+        )
+    except:
+        return HttpResponse("Invalid telegram ID", status=400)
+
+    passive_income, changed = start_player_session(player)
+    if changed:
+        player, passive_income = persist_player_session(telegram_id)
+
+    builders = {
+        "player": lambda: player_state_data(player, passive_income),
+        "boosts": lambda: player_boosts_data(player),
+        "upgrades": lambda: player_upgrades_data(player),
+        "memes": lambda: player_memes_data(player),
+        "tasks": lambda: player_tasks_data(player),
+        "leagues": all_leagues_data,
+        "friends_count": lambda: player.friends_count,
+    }
+    return JsonResponse({section: builders[section]() for section in BOOTSTRAP_SECTIONS if section in sections})
 
 def get_player_energy(request):
     telegram_id = request.GET.get("user_id")
-    player = Player.objects.get(telegram_id=telegram_id)
-    player = PlayerProcessor.calculate_energy(player)
-    player.last_seen = int(time.time())
-    player.save()
+    flush_pending_sync(telegram_id)
+    player = player_state_cache.get(telegram_id)
 
     res = {
-        "energy_count": player.energy_balance
+        "energy_count": PlayerProcessor.current_energy(player)
     }
 
     return JsonResponse(res)
 
-def get_task(request):
-    task_id = request.GET.get("task_id")
+def task_data(task_id) -> dict:
     task = Task.objects.get(id=task_id)
-    res = {
+    return {
         "name": task.name,
         "description": task.description,
         "logo": "",
@@ -202,7 +196,10 @@ def get_task(request):
         "penalty": task.penalty,
         "link": task.link,
     }
-    return JsonResponse(res)
+
+def get_task(request):
+    task_id = request.GET.get("task_id")
+    return CatalogResponseCache.respond(request, "task", task_id, lambda: task_data(task_id))
 
 
 @csrf_exempt
@@ -210,17 +207,20 @@ def complete_task(request):
     player_task_id = request.POST.get("task_id")
     with transaction.atomic():
         try:
-            player_task = PlayerTask.objects.get(id=player_task_id)
-            if player_task.status == "CM":
+            player_task = PlayerTask.objects.select_related("task").get(id=player_task_id)
+            # Conditional, so two concurrent requests can't both collect the reward
+            completed = (
+                PlayerTask.objects.filter(id=player_task.id)
+                .exclude(status="CM")
+                .update(status="CM", completion_date=timezone.now())
+            )
+            if not completed:
                 return JsonResponse(
                     {"status": "Error. Task already completed."}, status=400
                 )
-            player_task.status = "CM"
-            player_task.completion_date = timezone.now()
-            player_task.save()
-            player = player_task.player 
-            player = PlayerProcessor.add_coins(player, player_task.task.coins_reward)
-            player.save()
+            # The reward goes to the coin ledger instead of a read-modify-write
+            # of the player row, it is folded into the balance later.
+            LedgerProcessor.credit(player_task.player_id, player_task.task.coins_reward, "TA")
             return JsonResponse({"status": "success"})
         except ObjectDoesNotExist:
             return JsonResponse(
@@ -237,90 +237,115 @@ def update_coins_and_energy(request):
     user_id = request.POST.get("user_id")
     coins_count = int(request.POST.get("coins_count"))
     energy_count = int(request.POST.get("energy_count"))
-    player = Player.objects.get(telegram_id=user_id)
-    player = PlayerProcessor.update_coins(player, coins_count)
-    player.energy_balance = energy_count
-    player.last_seen = int(time.time())
-    player.save()
+    if settings.PLAYER_SYNC_WRITE_BEHIND:
+        player_sync_buffer.enqueue(int(user_id), coins_count, energy_count, int(time.time()))
+        return JsonResponse({"status": "success"})
+    if not PlayerProcessor.sync_taps(int(user_id), coins_count, energy_count, int(time.time())):
+        return JsonResponse({"error": "The balance changed during the sync, retry"}, status=409)
     return JsonResponse({"status": "success"})
 
 
 def friends_reffered_count(request):
     user_id = request.GET.get("user_id")
-    player = Player.objects.get(telegram_id=user_id)
-    return JsonResponse({"friends_reffered_count": player.friends.count()})
+    player = player_state_cache.get(user_id)
+    return JsonResponse(
+        {"friends_reffered_count": player.friends_count, "referrals_count": player.referrals_count}
+    )
+
+
+def friends_page_params(request):
+    """(limit, cursor) of a friends_list request, ValueError when invalid."""
+    limit = max(1, min(int(request.GET.get("limit") or 50), 100))
+    cursor = request.GET.get("cursor")
+    return limit, int(cursor) if cursor else None
 
 
 def friends_list(request):
     user_id = request.GET.get("user_id")
-    player = Player.objects.get(telegram_id=user_id)
-    friends = player.friends.values("name", "telegram_id")
-    return JsonResponse({"friends": list(friends)})
+    try:
+        limit, cursor = friends_page_params(request)
+    except ValueError:
+        return JsonResponse({"error": "Invalid limit or cursor"}, status=400)
+    player = player_state_cache.get(user_id)
+    friends, next_cursor = FriendsProcessor.get_page(player.pk, limit, cursor)
+    return JsonResponse({"friends": friends, "next_cursor": next_cursor})
+
+
+def player_tasks_data(player: Player) -> list:
+    player_tasks = PlayerTask.objects.filter(player=player).order_by("id")
+    task_fields = (
+        "id",
+        "task_id",
+        "task__name",
+        "task__coins_reward",
+        "task__description",
+        "task__penalty",
+        "task__link",
+        "task__logo",
+        "status",
+    )
+    tasks_data = list(player_tasks.values(*task_fields))
+
+    missing_tasks = active_task_catalog.get() - {task["task_id"] for task in tasks_data}
+    if missing_tasks:
+        # Re-check against the table, the catalog of another worker may
+        # still list a task that was deleted or deactivated since.
+        missing_tasks = Task.objects.filter(id__in=missing_tasks, active=True).values_list("id", flat=True)
+        PlayerTask.objects.bulk_create(
+            [PlayerTask(player=player, task_id=task_id) for task_id in missing_tasks],
+            ignore_conflicts=True,
+        )
+        tasks_data = list(player_tasks.values(*task_fields))
 
+    for task in tasks_data:
+        del task["task_id"]
+    return tasks_data
 
 def get_user_tasks(request):
     user_id = request.GET.get("user_id")
-    player = Player.objects.get(telegram_id=user_id)
-    player_task_count = PlayerTask.objects.filter(player=player).count()
-    total_tasks_count = Task.objects.filter(active=True).count()
-    if player_task_count < total_tasks_count:
-        existing_tasks = PlayerTask.objects.filter(player=player).values_list(
-            "task", flat=True
-        )
-        missing_tasks = Task.objects.filter(active=True).exclude(id__in=existing_tasks)
-
-        for task in missing_tasks:
-            PlayerTask.objects.create(player=player, task=task)
-
-    player_tasks = PlayerTask.objects.filter(player=player)
-    tasks_data = list(
-        player_tasks.values(
-            "id",
-            "task__name",
-            "task__coins_reward",
-            "task__description",
-            "task__penalty",
-            "task__link",
-            "task__logo",
-            "status",
-        )
-    )
-    return JsonResponse({"tasks": tasks_data})
+    player = player_state_cache.get(user_id)
+    return JsonResponse({"tasks": player_tasks_data(player)})
 
-def get_user_boosts(request):
-    user_id = request.GET.get("user_id")
-    player = Player.objects.get(telegram_id=user_id)
-    res = {
+def player_boosts_data(player: Player) -> dict:
+    # The boosts a session started now would have, without writing them
+    PlayerProcessor.update_boosts(player)
+    return {
         "rocket": player.rocket_count,
         "full_energy": player.full_energy_count,
     }
-    return JsonResponse(res)
 
-
-def get_user_upgrades(request):
-    user_id = request.GET.get("user_id")
-    player = Player.objects.get(telegram_id=user_id)
-    res = {
+def player_upgrades_data(player: Player) -> dict:
+    return {
         "multitap_level": player.multitap_level,
         "recharging_speed_level": player.recharging_speed_level,
         "energy_limit_level": player.energy_limit_level,
     }
-    return JsonResponse(res)
+
+def get_user_boosts(request):
+    user_id = request.GET.get("user_id")
+    player = player_state_cache.get(user_id)
+    return JsonResponse(player_boosts_data(player))
+
+
+def get_user_upgrades(request):
+    user_id = request.GET.get("user_id")
+    player = player_state_cache.get(user_id)
+    return JsonResponse(player_upgrades_data(player))
 
 
 @csrf_exempt
 def use_boost(request):
     user_id = request.POST.get("user_id")
     boost: str = request.POST.get("boost")
+    flush_pending_sync(user_id)
     try:
-        player = Player.objects.get(telegram_id=user_id)
         response = {"boost": boost}
-        player, count, success = PlayerProcessor.use_boost(player, boost)
-        player.save()
-        if not success:
-            HttpResponse("Not enough boosts", status=406)
-        else:
-            response["count"] = count
+        count = PlayerProcessor.use_boost(user_id, boost)
+        if count is None:
+            if not Player.objects.filter(telegram_id=user_id).exists():
+                raise Player.DoesNotExist
+            return HttpResponse("Not enough boosts", status=406)
+        response["count"] = count
 
         return JsonResponse(response)
     except Player.DoesNotExist:
@@ -342,8 +367,13 @@ def buy_upgrade(request):
         "rechargingSpeed": "recharging_speed_level",
         "energyLimit": "energy_limit_level"
     }.get(upgrade_request)
+    flush_pending_sync(user_id)
     try:
-        player = Player.objects.get(telegram_id=user_id)
+        player = (
+            Player.objects.only(upgrade)
+            .annotate(pending_coins=LedgerProcessor.pending_coins())
+            .get(telegram_id=user_id)
+        )
         current_level = getattr(player, upgrade)
         try:
             cost = UPGRADE_PRICES[current_level-1]
@@ -364,14 +394,28 @@ def buy_upgrade(request):
                 },
                 status=400,
             )
-        if player.coins_balance < cost:
+        if player.pending_coins:
+            # Unfolded ledger credits are spendable, fold them first
+            LedgerProcessor.fold_player(player.pk)
+        with transaction.atomic():
+            # Debit and level up in one statement; the level guard makes a
+            # concurrent upgrade of the same level fail instead of charging twice.
+            changes = {"coins_balance": F("coins_balance") - cost, upgrade: F(upgrade) + 1}
+            if upgrade in ("energy_limit_level", "recharging_speed_level"):
+                # Settle the energy regenerated at the old levels first
+                changes.update(PlayerProcessor.energy_rebase())
+            upgraded = update_returning(
+                Player.objects.filter(telegram_id=user_id, coins_balance__gte=cost, **{upgrade: current_level}),
+                [upgrade],
+                **changes,
+            )
+            if upgraded is not None:
+                LedgerProcessor.record_applied(player.pk, -cost, "UP")
+                player_state_cache.invalidate([player.pk])
+        if upgraded is None:
             return JsonResponse(
                 {"status": "failed", "message": "Not enough coins."}, status=400
             )
-
-        setattr(player, upgrade, current_level + 1)
-        player.coins_balance -= cost
-        player.save()
         return JsonResponse(
             {
                 "status": "success",
@@ -388,30 +432,51 @@ def buy_upgrade(request):
         )
 
 
+def teams_data(search_query: str, limit: int, cursor) -> dict:
+    teams, next_cursor = TeamProcessor.search(search_query, limit, cursor)
+    return {"teams": teams, "next_cursor": next_cursor}
+
+
 def get_teams(request):
-    search_query = request.GET.get("search_query")
-    teams = Team.objects.filter(name__startswith=search_query)
-    teams_data = list(teams.values("id", "name"))
-    return JsonResponse({"teams": teams_data})
+    search_query = request.GET.get("search_query") or ""
+    try:
+        limit = max(1, min(int(request.GET.get("limit") or 20), 50))
+        cursor = request.GET.get("cursor")
+        if cursor:
+            team_id, _, search_name = cursor.partition(":")
+            cursor = (int(team_id), search_name)
+    except ValueError:
+        return JsonResponse({"error": "Invalid limit or cursor"}, status=400)
+
+    return CatalogResponseCache.respond(
+        request, "team", (search_query, limit, cursor), lambda: teams_data(search_query, limit, cursor or None)
+    )
+
+
+def team_data(team_id) -> dict:
+    team = Team.objects.get(id=team_id)
+    return {"name": team.name, "channel_link": team.channel_link}
 
 
 def get_team(request):
     team_id = request.GET.get("team_id")
-    team = Team.objects.get(id=team_id)
-    res = {"name": team.name, "channel_link": team.channel_link}
-    return JsonResponse(res)
+    return CatalogResponseCache.respond(request, "team", f"id:{team_id}", lambda: team_data(team_id))
 
 
 @csrf_exempt
 def join_team(request):
     user_id = request.POST.get("user_id")
     team_id = request.POST.get("team_id")
+    flush_pending_sync(user_id)
 
     try:
-        player = Player.objects.get(telegram_id=user_id)
         team = Team.objects.get(id=team_id)
-        player.team = team
-        player.save()
+        with transaction.atomic():
+            # Locked, so a concurrent move or earnings flush can't start from
+            # the same team_id and count the player's coins twice
+            player = Player.objects.select_for_update().get(telegram_id=user_id)
+            TeamProcessor.move_player(player, team)
+            player.save()
         return JsonResponse(
             {"status": "success", "message": "Successfully joined the team."}
         )
@@ -432,11 +497,13 @@ def join_team(request):
 @csrf_exempt
 def leave_team(request):
     user_id = request.POST.get("user_id")
+    flush_pending_sync(user_id)
 
     try:
-        player = Player.objects.get(telegram_id=user_id)
-        player.team = None
-        player.save()
+        with transaction.atomic():
+            player = Player.objects.select_for_update().get(telegram_id=user_id)
+            TeamProcessor.move_player(player, None)
+            player.save()
         return JsonResponse(
             {"status": "success", "message": "Successfully left the team."}
         )
@@ -451,123 +518,172 @@ def leave_team(request):
 
 
 def get_top_teams(request):
-    limit = request.GET.get("limit")
-    if not limit: limit = 5
-    top_teams = Team.objects.annotate(
-        total_coins_earned=Sum("users__total_coins_earned")
-    ).order_by("-total_coins_earned")[:limit]
-    teams_data = list(top_teams.values("id", "name"))
+    try:
+        limit = int(request.GET.get("limit") or 5)
+    except ValueError:
+        limit = 5
+    limit = max(1, min(limit, settings.TEAM_LEADERBOARD_SIZE))
+    teams_data = TeamProcessor.get_top_teams(limit)
     return JsonResponse({"teams": teams_data})
 
 def get_league(request):
-    time_period = request.GET.get("time_period")
+    time_period = "day" if request.GET.get("time_period") == "day" else "week"
     league = request.GET.get("league")
-    players = Player.objects.filter(league=league).order_by(
-        "total_earned_day" if time_period == "day" else "total_earned_week"
-    )
-    players_league_data = list(
-        players.values(
-            "telegram_id",
-            "name",
-            "total_earned_day" if time_period == "day" else "total_earned_week",
-        )
-    )
-    return JsonResponse({"league": players_league_data})
-
-def get_all_leagues(request):
-    leagues = list(League.objects.values().order_by("level").all())
-    return JsonResponse(
+    try:
+        limit = max(1, min(int(request.GET.get("limit") or 50), 100))
+        cursor = request.GET.get("cursor")
+        if cursor:
+            earned, telegram_id = cursor.split(":")
+            cursor = (int(earned), int(telegram_id))
+    except ValueError:
+        return JsonResponse({"error": "Invalid limit or cursor"}, status=400)
+
+    players_league_data, next_cursor = LeagueLeaderboard.get_page(league, time_period, limit, cursor or None)
+    return JsonResponse({"league": players_league_data, "next_cursor": next_cursor})
+
+def get_league_rank(request):
+    user_id = request.GET.get("user_id")
+    try:
+        neighbours = max(0, min(int(request.GET.get("neighbours") or 5), 50))
+    except ValueError:
+        neighbours = 5
+    rank = LeagueRankProcessor.get_rank(user_id, neighbours)
+    if rank is None:
+        return JsonResponse({"error": "Player is not ranked yet"}, status=404)
+    return JsonResponse(rank)
+
+def all_leagues_data() -> list:
+    leagues = sorted(league_ladder.get()["leagues"], key=lambda league: league.level)
+    return [
         {
-            "leagues": leagues
+            "id": league.id,
+            "name": league.name,
+            "level": league.level,
+            "coin_limit": league.coin_limit,
+            "logo": league.logo,
         }
-    )
+        for league in leagues
+    ]
 
-def get_player_memes(request):
-    user_id = request.GET.get("user_id")
-    try:
-        player = Player.objects.get(pk=user_id)
-    except Player.DoesNotExist:
-        return JsonResponse({"error": "Player not found"}, status=404)
+def get_all_leagues(request):
+    return CatalogResponseCache.respond(request, "league", None, lambda: {"leagues": all_leagues_data()})
 
-    memes_data = []
-    all_memes = Meme.objects.all()
+def player_memes_data(player: Player) -> list:
+    player_memes = {
+        player_meme["meme_id"]: player_meme
+        for player_meme in MemePlayer.objects.filter(player=player).values(
+            "meme_id", "current_level", "current_coins_per_hour", "current_upgrade_cost"
+        )
+    }
 
-    for meme in all_memes:
-        try:
-            player_meme = MemePlayer.objects.get(player=player, meme=meme)
+    memes_data = []
+    catalog = meme_catalog.get()
+    for meme in catalog["memes"]:
+        player_meme = player_memes.get(meme["id"])
+        if player_meme:
             memes_data.append(
                 {
-                    "meme_id": meme.id,
-                    "name": meme.name,
-                    "level": player_meme.current_level,
-                    "coins_per_hour": player_meme.current_coins_per_hour,
-                    "upgraded_coins_per_hour": int(meme.coins_per_hour * (1.1**(player_meme.current_level+1))),
-                    "upgrade_cost": player_meme.current_upgrade_cost,
-                    "logo": player_meme.meme.logo,
+                    "meme_id": meme["id"],
+                    "name": meme["name"],
+                    "level": player_meme["current_level"],
+                    "coins_per_hour": player_meme["current_coins_per_hour"],
+                    "upgraded_coins_per_hour": catalog["curves"][meme["id"]].income(player_meme["current_level"] + 1),
+                    "upgrade_cost": player_meme["current_upgrade_cost"],
+                    "logo": meme["logo"],
                 }
             )
-        except MemePlayer.DoesNotExist:
+        else:
             memes_data.append(
                 {
-                    "meme_id": meme.id,
-                    "name": meme.name,
+                    "meme_id": meme["id"],
+                    "name": meme["name"],
                     "level": 0,
                     "coins_per_hour": 0,
-                    "upgraded_coins_per_hour": meme.coins_per_hour,
-                    "upgrade_cost": meme.upgrade_price,
-                    "logo": meme.logo,
+                    "upgraded_coins_per_hour": meme["coins_per_hour"],
+                    "upgrade_cost": meme["upgrade_price"],
+                    "logo": meme["logo"],
                 }
             )
-    return JsonResponse({"memes": memes_data})
+    return memes_data
+
+def get_player_memes(request):
+    user_id = request.GET.get("user_id")
+    try:
+        player = player_state_cache.get(user_id)
+    except Player.DoesNotExist:
+        return JsonResponse({"error": "Player not found"}, status=404)
+
+    return JsonResponse({"memes": player_memes_data(player)})
 
 @csrf_exempt
 def manage_meme(request):
     player_id = request.POST.get("user_id")
     meme_id = request.POST.get("meme_id")
+    flush_pending_sync(player_id)
 
     # Try to fetch player and meme details
     try:
-        player = Player.objects.get(pk=player_id)
+        player = (
+            Player.objects.only("telegram_id")
+            .annotate(pending_coins=LedgerProcessor.pending_coins())
+            .get(pk=player_id)
+        )
         meme = Meme.objects.get(pk=meme_id)
     except (Player.DoesNotExist, Meme.DoesNotExist):
         return JsonResponse({"error": "Player or Meme not found"}, status=404)
 
+    if player.pending_coins:
+        # Unfolded ledger credits are spendable, fold them first
+        LedgerProcessor.fold_player(player.pk)
+
     # Determine if the meme is already owned by the player
-    meme_owned = MemePlayer.objects.filter(player=player, meme=meme).exists()
+    memeplayer = MemePlayer.objects.filter(player=player, meme=meme).first()
 
-    if not meme_owned:
+    curve = meme_catalog.curve(meme)
+    if memeplayer is None:
         # Handle purchase
-        if player.coins_balance < meme.upgrade_price:
-            return JsonResponse({"error": "Insufficient funds"}, status=400)
-
-        # Deduct the cost and update player balance
-        player.coins_balance -= meme.upgrade_price
-        player.save()
-
-        new_upgrade_cost = meme.upgrade_price * 2
-        # Create a new ownership record
-        new_meme_player = MemePlayer(
-            player=player,
-            meme=meme,
-            current_coins_per_hour=meme.coins_per_hour,
-            current_upgrade_cost=new_upgrade_cost,
-            current_level=1,
-        )
-        new_meme_player.save()
-
-        memesplayer = MemePlayer.objects.filter(player=player).all()
-        coins_per_hour = 0
-        for pair in memesplayer:
-            coins_per_hour += pair.current_coins_per_hour
-        player.total_coins_per_hour = coins_per_hour
-        player.save()
+        new_upgrade_cost = curve.cost(1)
+        try:
+            with transaction.atomic():
+                # Income so far was earned at the old rate
+                current_time = int(time.time())
+                settled = PlayerProcessor.settle_passive_income(Player.objects.filter(pk=player.pk), current_time)
+                # Deduct the cost and add the meme income only if the balance
+                # covers it, in the same statement
+                balances = update_returning(
+                    Player.objects.filter(pk=player.pk, coins_balance__gte=meme.upgrade_price),
+                    ["coins_balance", "total_coins_per_hour"],
+                    coins_balance=F("coins_balance") - meme.upgrade_price,
+                    total_coins_per_hour=F("total_coins_per_hour") + curve.income(1),
+                    **PlayerProcessor.energy_rebase(current_time),
+                )
+                if balances is None:
+                    transaction.set_rollback(True)
+                    return JsonResponse({"error": "Insufficient funds"}, status=400)
+                LedgerProcessor.record_applied(player.pk, -meme.upgrade_price, "ME")
+                player_state_cache.invalidate([player.pk])
+                # Create a new ownership record
+                new_meme_player = MemePlayer.objects.create(
+                    player=player,
+                    meme=meme,
+                    current_coins_per_hour=curve.income(1),
+                    current_upgrade_cost=new_upgrade_cost,
+                    current_level=1,
+                )
+        except IntegrityError:
+            # A concurrent request bought it first, the debit was rolled back
+            return JsonResponse({"error": "Meme already purchased"}, status=400)
+        coins_balance = balances["coins_balance"]
+        if settled:
+            # The settled income stays in the ledger until the next fold
+            coins_balance += LedgerProcessor.pending_for([player.pk]).get(player.pk, 0)
 
         # Return success response
         return JsonResponse(
             {
                 "message": "Meme purchased successfully",
-                "player_coins_balance": player.coins_balance,
-                "coins_per_hour": player.total_coins_per_hour,
+                "player_coins_balance": coins_balance,
+                "coins_per_hour": balances["total_coins_per_hour"],
                 "meme_details": {
                     "name": meme.name,
                     "coins_per_hour": new_meme_player.current_coins_per_hour,
@@ -577,40 +693,56 @@ def manage_meme(request):
         )
     else:
         # Handle upgrade
-        memeplayer = MemePlayer.objects.get(player=player, meme=meme)
         next_level = memeplayer.current_level + 1
-        new_upgrade_cost = memeplayer.current_upgrade_cost * 2
-
-        if player.coins_balance < new_upgrade_cost:
-            return JsonResponse({"error": "Insufficient funds"}, status=400)
+        new_upgrade_cost = curve.cost(next_level)
+        new_coins_per_hour = curve.income(next_level)
+        coins_per_hour_delta = new_coins_per_hour - memeplayer.current_coins_per_hour
+
+        with transaction.atomic():
+            # Income so far was earned at the old rate
+            current_time = int(time.time())
+            settled = PlayerProcessor.settle_passive_income(Player.objects.filter(pk=player.pk), current_time)
+            # Deduct the cost and apply the income difference, only if the
+            # balance covers it
+            balances = update_returning(
+                Player.objects.filter(pk=player.pk, coins_balance__gte=new_upgrade_cost),
+                ["coins_balance", "total_coins_per_hour"],
+                coins_balance=F("coins_balance") - new_upgrade_cost,
+                total_coins_per_hour=F("total_coins_per_hour") + coins_per_hour_delta,
+                **PlayerProcessor.energy_rebase(current_time),
+            )
+            if balances is None:
+                transaction.set_rollback(True)
+                return JsonResponse({"error": "Insufficient funds"}, status=400)
+            LedgerProcessor.record_applied(player.pk, -new_upgrade_cost, "ME")
+            player_state_cache.invalidate([player.pk])
+
+            # Update memeplayer details, guarded on the level we priced so a
+            # concurrent upgrade can't be charged twice for the same level
+            upgraded = MemePlayer.objects.filter(
+                pk=memeplayer.pk, current_level=memeplayer.current_level
+            ).update(
+                current_level=next_level,
+                current_coins_per_hour=new_coins_per_hour,
+                current_upgrade_cost=new_upgrade_cost,
+            )
+            if not upgraded:
+                transaction.set_rollback(True)
+                return JsonResponse({"error": "Meme was upgraded concurrently"}, status=409)
 
-        # Update memeplayer details
-        memeplayer.current_level = next_level
-        memeplayer.current_coins_per_hour = int(
-            memeplayer.meme.coins_per_hour * (1.1**next_level)
-        )
-        memeplayer.current_upgrade_cost = new_upgrade_cost
-        memeplayer.save()
-
-        # Deduct the cost and update player balance
-        player.coins_balance -= new_upgrade_cost
-        memesplayer = MemePlayer.objects.filter(player=player).all()
-        coins_per_hour = 0
-        for pair in memesplayer:
-            coins_per_hour += pair.current_coins_per_hour
-        player.total_coins_per_hour = coins_per_hour
-        player.save()
-        
+        coins_balance = balances["coins_balance"]
+        if settled:
+            coins_balance += LedgerProcessor.pending_for([player.pk]).get(player.pk, 0)
 
         # Return success response
         return JsonResponse(
             {
                 "message": "Meme upgraded successfully",
-                "new_level": memeplayer.current_level,
-                "new_coins_per_hour": memeplayer.current_coins_per_hour,
-                "new_upgrade_cost": memeplayer.current_upgrade_cost,
-                "player_coins_balance": player.coins_balance,
-                "coins_per_hour": player.total_coins_per_hour
+                "new_level": next_level,
+                "new_coins_per_hour": new_coins_per_hour,
+                "new_upgrade_cost": new_upgrade_cost,
+                "player_coins_balance": coins_balance,
+                "coins_per_hour": balances["total_coins_per_hour"]
             }
         )
 
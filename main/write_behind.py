@@ -0,0 +1,153 @@
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Player
+from .player_cache import player_state_cache
+from .processors import EarningsProcessor, LedgerProcessor, PlayerProcessor
+
+logger = logging.getLogger(__name__)
+
+
+class PlayerSyncBuffer:
+    """
+    Holds the latest tap sync (coins, energy, last_seen) per player and writes
+    them to the database in one bulk_update per flush. Repeated syncs from the
+    same player between two flushes collapse into a single row update.
+
+    Like PlayerProcessor.sync_taps, a flush only applies a sync while the
+    player's coins_balance and total_coins_earned are still what the first
+    sync of the batch read. A purchase, fold or another worker's flush in
+    between drops the buffered sync instead of overwriting that change; the
+    client's next sync reports its full balance again.
+    """
+    FIELDS = [
+        "coins_balance",
+        "total_coins_earned",
+        "total_earned_day",
+        "earned_day_key",
+        "total_earned_week",
+        "earned_week_key",
+        "league",
+        "energy_balance",
+        "last_seen",
+    ]
+
+    def __init__(self, flush_interval: float, max_pending: int, batch_size: int = 1000):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def enqueue(self, telegram_id: int, coins_count: int, energy_count: int, last_seen: int):
+        with self._lock:
+            entry = self._pending.get(telegram_id)
+        if entry is not None:
+            read = entry[3]
+        else:
+            read = (
+                Player.objects.filter(telegram_id=telegram_id)
+                .values_list("coins_balance", "total_coins_earned")
+                .first()
+            )
+            if read is None:
+                return
+        with self._lock:
+            # A concurrent first sync may have read already, keep its balance
+            entry = self._pending.get(telegram_id)
+            if entry is not None:
+                read = entry[3]
+            self._pending[telegram_id] = (coins_count, energy_count, last_seen, read)
+            pending_count = len(self._pending)
+            if self._thread is None and not self._stopped:
+                self._start()
+        if pending_count >= self.max_pending:
+            self._wake.set()
+
+    def flush_player(self, telegram_id: int):
+        # Called before any other write to the player row so that an older
+        # buffered sync can't land on top of it later.
+        with self._lock:
+            entry = self._pending.pop(telegram_id, None)
+        if entry is not None:
+            self._write({telegram_id: entry})
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            self._write(pending)
+
+    def close(self):
+        self._stopped = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_interval + 5)
+        self.flush()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="player-sync-flusher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            if self._stopped:
+                break
+            try:
+                self.flush()
+            except Exception:
+                logger.exception("Player sync flush failed")
+            finally:
+                close_old_connections()
+
+    def _write(self, pending: dict):
+        with self._write_lock:
+            try:
+                with transaction.atomic():
+                    players = list(
+                        Player.objects.select_for_update()
+                        .filter(telegram_id__in=pending.keys())
+                        .order_by("telegram_id")
+                    )
+                    # Read after locking the players, folds can't run under the locks
+                    unfolded = LedgerProcessor.pending_for(pending.keys())
+                    synced = []
+                    for player in players:
+                        coins_count, energy_count, last_seen, read = pending[player.telegram_id]
+                        if (player.coins_balance, player.total_coins_earned) != read:
+                            continue
+                        PlayerProcessor.update_coins(player, coins_count, unfolded.get(player.telegram_id, 0))
+                        player.energy_balance = energy_count
+                        player.last_seen = last_seen
+                        synced.append(player)
+                    if len(synced) < len(players):
+                        logger.info("Dropped %d player syncs, the players changed since", len(players) - len(synced))
+                    Player.objects.bulk_update(synced, self.FIELDS, batch_size=self.batch_size)
+                    player_state_cache.invalidate([player.telegram_id for player in synced])
+                    EarningsProcessor.commit(synced)
+            except Exception:
+                self._requeue(pending)
+                raise
+
+    def _requeue(self, pending: dict):
+        # Put failed entries back unless a newer sync arrived in the meantime.
+        with self._lock:
+            for telegram_id, entry in pending.items():
+                self._pending.setdefault(telegram_id, entry)
+
+
+player_sync_buffer = PlayerSyncBuffer(
+    flush_interval=settings.PLAYER_SYNC_FLUSH_INTERVAL,
+    max_pending=settings.PLAYER_SYNC_MAX_PENDING,
+)
+atexit.register(player_sync_buffer.close)